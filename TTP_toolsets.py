@@ -1,28 +1,310 @@
+import abc
+import copy
 import cv2
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+import weakref
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageFilter, ImageChops, ImageEnhance
-import node_helpers
+import folder_paths
 import torch
+import torch.nn.functional as F
 import comfy.model_management
 import comfy.samplers
 import comfy.sample
 import comfy.utils
 import latent_preview
-from typing import Any, List, Tuple, Optional, Union, Dict
+from typing import List, Tuple, Union, Dict
+
+logger = logging.getLogger(__name__)
 
 def pil2tensor(image: Image) -> torch.Tensor:
-    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+    # One uint8 copy out of PIL, then a single float buffer scaled in place
+    return torch.from_numpy(np.array(image)).to(torch.float32).div_(255.0).unsqueeze(0)
 
 def tensor2pil(t_image: torch.Tensor) -> Image:
-    return Image.fromarray(np.clip(255.0 * t_image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
+    return Image.fromarray(t_image.detach().cpu().squeeze().mul(255.0).clamp_(0, 255).to(torch.uint8).numpy())
+
+def tensor2np(t_image: torch.Tensor, keep_float: bool = False) -> np.ndarray:
+    """(H, W, C) array of one image for OpenCV.
+
+    uint8 with the same rounding as tensor2pil, or float32 in 0..1 when keep_float is set;
+    float32 CPU tensors are then shared without a copy.
+    """
+    t_image = t_image.detach().cpu()
+    if keep_float:
+        return t_image.to(torch.float32).numpy()
+    return t_image.mul(255.0).clamp_(0, 255).to(torch.uint8).numpy()
+
+def np2tensor(array: np.ndarray) -> torch.Tensor:
+    """Inverse of tensor2np, returns a (1, H, W, C) float tensor."""
+    tensor = torch.from_numpy(np.ascontiguousarray(array))
+    if tensor.dtype == torch.uint8:
+        tensor = tensor.to(torch.float32).div_(255.0)
+    return tensor.unsqueeze(0)
     
+@functools.lru_cache(maxsize=64)
+def gradient_ramp(size, curve="linear"):
+    """Falling 1 -> 0 blend ramp of `size` steps, quantised to 8-bit levels like the PIL masks."""
+    t = np.arange(size, dtype=np.float64) / size
+    if curve == "cosine":
+        values = 0.5 * (1 + np.cos(np.pi * t))
+    elif curve == "smoothstep":
+        values = 1 - t * t * (3 - 2 * t)
+    else:
+        values = 1 - t
+    ramp = np.floor(255 * values) / 255
+    ramp.setflags(write=False)
+    return ramp
+
+
+@functools.lru_cache(maxsize=32)
+def gradient_mask(size, direction, curve="linear"):
+    """Blend mask for a seam of `size` (width, height); cached because every seam of a grid has the same size."""
+    width, height = size
+    if direction == 'horizontal':
+        values = np.broadcast_to(gradient_ramp(width, curve)[None, :], (height, width))
+    else:
+        values = np.broadcast_to(gradient_ramp(height, curve)[:, None], (height, width))
+    return Image.fromarray(np.rint(values * 255).astype(np.uint8), mode="L")
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def scratch_memmap(shape, dtype=np.float32, prefix="ttp_"):
+    """Zero-filled, file-backed array in ComfyUI's temp directory.
+
+    The file is unlinked straight away where the OS allows it, so its space is released
+    as soon as the last view of the array is dropped; otherwise it is removed on finalisation.
+    """
+    temp_dir = folder_paths.get_temp_directory()
+    os.makedirs(temp_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".bin", dir=temp_dir)
+    os.close(fd)
+    array = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+    try:
+        os.unlink(path)
+    except OSError:
+        weakref.finalize(array, _remove_file, path)
+    return array
+
+
+def unpack_position(position):
+    """Split a tile position into (frame, left, upper, right, lower).
+
+    Positions of single-image batches are plain 4-tuples; multi-image batches append the frame index.
+    """
+    if len(position) == 5:
+        left, upper, right, lower, frame = position
+    else:
+        left, upper, right, lower = position
+        frame = 0
+    return frame, left, upper, right, lower
+
+
+def fixed_tile_starts(size, tile_size):
+    """Tile origins along one axis: ceil(size / tile_size) tiles, leftover spread as overlap."""
+    if size <= tile_size:
+        return [0]
+    num_tiles = (size + tile_size - 1) // tile_size
+    overlap = (num_tiles * tile_size - size) // (num_tiles - 1)
+    step = tile_size - overlap
+    starts = []
+    for i in range(num_tiles):
+        start = i * step
+        # Snap the last tile to the image edge
+        if min(start + tile_size, size) - start < tile_size:
+            start = max(0, size - tile_size)
+        starts.append(start)
+    return starts
+
+
+def plan_tile_axis(size, max_tile, min_overlap=0, align=8, num_tiles=None):
+    """Cheapest tiling of one image axis.
+
+    Searches tile counts and tile sizes (multiples of `align`, at most `max_tile`) whose
+    neighbours overlap by at least `min_overlap`, minimising num_tiles * tile_size - the
+    per-axis factor of total tiles x tile area. Pass `num_tiles` to fix the count and only
+    size the tiles. Returns (tile_size, starts) with the tiles spread evenly and the last
+    one ending on the image edge.
+    """
+    align = max(1, align)
+    if num_tiles is None and size <= max_tile or num_tiles == 1:
+        return size, [0]
+
+    def tile_size_for(count):
+        needed = -(-(size + (count - 1) * min_overlap) // count)
+        return min(-(-needed // align) * align, size)
+
+    if num_tiles is not None:
+        counts = [num_tiles]
+    else:
+        usable = max_tile // align * align - min_overlap
+        if usable <= 0:
+            raise ValueError(f"min_overlap ({min_overlap}) must be smaller than the aligned tile size ({max_tile // align * align})")
+        first = max(2, -(-(size - min_overlap) // usable))
+        counts = range(first, first + 4)
+
+    best = None
+    for count in counts:
+        tile_size = tile_size_for(count)
+        if tile_size <= min_overlap or (num_tiles is None and tile_size > max_tile):
+            continue
+        if best is None or count * tile_size < best[0] * best[1]:
+            best = (count, tile_size)
+    if best is None:
+        raise ValueError(f"Cannot tile {size}px into {num_tiles} tiles with at least {min_overlap}px overlap")
+
+    count, tile_size = best
+    starts = [round(i * (size - tile_size) / (count - 1)) for i in range(count)]
+    return tile_size, starts
+
+
+def tile_grid_index(starts_y, starts_x, tile_height, tile_width, device=None):
+    """Index tensors that pick every tile of a grid with a single advanced-indexing gather.
+
+    Returns `ys` shaped (rows, 1, tile_height, 1) and `xs` shaped (1, cols, 1, tile_width);
+    `image[ys, xs]` on a (H, W, C) tensor yields (rows, cols, tile_height, tile_width, C).
+    """
+    ys = torch.tensor(starts_y, device=device).view(-1, 1, 1, 1) + torch.arange(tile_height, device=device).view(1, 1, -1, 1)
+    xs = torch.tensor(starts_x, device=device).view(1, -1, 1, 1) + torch.arange(tile_width, device=device).view(1, 1, 1, -1)
+    return ys, xs
+
+
+def seam_weights(spans, padding, curve="linear"):
+    """Per-tile 1-D blend weights for consecutive (start, end) spans along one axis.
+
+    The seams are placed exactly where TTP_Image_Assy.blend_tiles puts them, so multiplying the
+    row and column weights reproduces the PIL gradient blend.
+    """
+    weights = [torch.ones(end - start, dtype=torch.float32) for start, end in spans]
+    for k in range(1, len(spans)):
+        overlap = spans[k - 1][1] - spans[k][0]
+        if overlap <= 0:
+            continue
+        blend_size = min(padding, overlap)
+        # Weight of the previous tile inside the overlap; the new tile gets the rest
+        prev_weight = torch.zeros(overlap, dtype=torch.float32)
+        if blend_size > 0:
+            offset = (overlap - blend_size) // 2
+            prev_weight[:offset] = 1.0
+            prev_weight[offset:offset + blend_size] = torch.from_numpy(gradient_ramp(blend_size, curve).astype(np.float32))
+        weights[k - 1][-overlap:] *= prev_weight
+        weights[k][:overlap] *= 1.0 - prev_weight
+    return weights
+
+
+def gather_boxes(image, positions):
+    """Crop equally sized boxes given as tile positions out of an (N, H, W, C) image in one gather."""
+    boxes = [unpack_position(p) for p in positions]
+    device = image.device
+    box_w = boxes[0][3] - boxes[0][1]
+    box_h = boxes[0][4] - boxes[0][2]
+    frames = torch.tensor([b[0] for b in boxes], device=device)
+    lefts = torch.tensor([b[1] for b in boxes], device=device)
+    uppers = torch.tensor([b[2] for b in boxes], device=device)
+    ys = uppers[:, None, None] + torch.arange(box_h, device=device)[None, :, None]
+    xs = lefts[:, None, None] + torch.arange(box_w, device=device)[None, None, :]
+    return image[frames[:, None, None], ys, xs]
+
+
+def tile_detail_scores(tiles, metric="variance", chunk_size=16):
+    """Cheap per-tile detail score: luma variance or mean absolute Laplacian response.
+
+    Flat tiles (sky, studio backdrops, letterbox bars) score near zero. Works in chunks so
+    disk-backed tile batches are never fully loaded.
+    """
+    laplacian = torch.tensor([[0.0, 1.0, 0.0], [1.0, -4.0, 1.0], [0.0, 1.0, 0.0]]).view(1, 1, 3, 3)
+    luma_weights = torch.tensor([0.299, 0.587, 0.114])
+    scores = []
+    for chunk in tiles.split(chunk_size):
+        chunk = chunk.to(torch.float32)
+        luma = (chunk[..., :3] * luma_weights.to(chunk.device)).sum(-1) if chunk.shape[-1] >= 3 else chunk.mean(-1)
+        if metric == "laplacian":
+            response = F.conv2d(luma[:, None], laplacian.to(chunk.device))
+            scores.append(response.abs().mean(dim=(1, 2, 3)).cpu())
+        else:
+            scores.append(luma.var(dim=(1, 2)).cpu())
+    return torch.cat(scores)
+
+
 def apply_gaussian_blur(image_np, ksize=5, sigmaX=1.0):
     if ksize % 2 == 0:
         ksize += 1  # ksize must be odd
     blurred_image = cv2.GaussianBlur(image_np, (ksize, ksize), sigmaX=sigmaX)
     return blurred_image
 
-        
+
+def gaussian_kernel1d(ksize, sigma):
+    """1-D Gaussian taps as built by cv2.getGaussianKernel for sigma > 0."""
+    x = torch.arange(ksize, dtype=torch.float64) - (ksize - 1) / 2
+    kernel = torch.exp(-(x * x) / (2 * sigma * sigma))
+    return (kernel / kernel.sum()).to(torch.float32)
+
+
+def apply_gaussian_blur_torch(images, ksize=5, sigmaX=1.0):
+    """Separable Gaussian blur of a (B, C, H, W) batch with cv2's default reflect-101 border."""
+    if ksize % 2 == 0:
+        ksize += 1  # ksize must be odd
+    if ksize == 1:
+        return images
+    channels = images.shape[1]
+    pad = ksize // 2
+    kernel = gaussian_kernel1d(ksize, sigmaX).to(device=images.device, dtype=images.dtype)
+    images = F.conv2d(F.pad(images, (pad, pad, 0, 0), mode="reflect"), kernel.view(1, 1, 1, -1).expand(channels, 1, 1, ksize), groups=channels)
+    images = F.conv2d(F.pad(images, (0, 0, pad, pad), mode="reflect"), kernel.view(1, 1, -1, 1).expand(channels, 1, ksize, 1), groups=channels)
+    return images
+
+
+@functools.lru_cache(maxsize=32)
+def inter_area_weights(src_size, dst_size):
+    """(dst_size, src_size) matrix of cv2 INTER_AREA downscaling weights along one axis.
+
+    Follows OpenCV's computeResizeAreaTab: each output pixel averages the source cells its
+    footprint covers, with the partly covered cells at both ends weighted by their overlap.
+    """
+    scale = 1.0 / (dst_size / src_size)
+    weights = np.zeros((dst_size, src_size), dtype=np.float32)
+    for dx in range(dst_size):
+        fsx1 = dx * scale
+        fsx2 = fsx1 + scale
+        cell_width = min(scale, src_size - fsx1)
+        sx2 = min(int(np.floor(fsx2)), src_size - 1)
+        sx1 = min(int(np.ceil(fsx1)), sx2)
+        if sx1 - fsx1 > 1e-3:
+            weights[dx, sx1 - 1] = (sx1 - fsx1) / cell_width
+        weights[dx, sx1:sx2] = 1.0 / cell_width
+        if fsx2 - sx2 > 1e-3:
+            weights[dx, sx2] = min(fsx2 - sx2, 1.0, cell_width) / cell_width
+    return torch.from_numpy(weights)
+
+
+def resize_area_torch(images, size):
+    """cv2 INTER_AREA downscaling of a (B, C, H, W) batch to (height, width) with two matmuls.
+
+    F.interpolate(mode="area") is adaptive average pooling, which only matches INTER_AREA at
+    integer factors; the per-axis weight matrices reproduce OpenCV at any factor.
+    """
+    height, width = images.shape[-2:]
+    if height != size[0]:
+        images = torch.matmul(inter_area_weights(height, size[0]).to(images), images)
+    if width != size[1]:
+        images = torch.matmul(images, inter_area_weights(width, size[1]).to(images).T)
+    return images
+
+
 class TTPlanet_Tile_Preprocessor_Simple:
     def __init__(self, blur_strength=3.0):
         self.blur_strength = blur_strength
@@ -35,7 +317,11 @@ class TTPlanet_Tile_Preprocessor_Simple:
                 "scale_factor": ("FLOAT", {"default": 2.00, "min": 1.00, "max": 8.00, "step": 0.05}),
                 "blur_strength": ("FLOAT", {"default": 1.0, "min": 1.0, "max": 20.0, "step": 0.1}),
             },
-            "optional": {}
+            "optional": {
+                "backend": (["cv2", "torch"], {"default": "cv2", "tooltip": "cv2 reproduces earlier results; torch runs on the GPU in batches and matches cv2 to within two levels per channel (8-bit rounding)"}),
+                "cv2_workers": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1, "tooltip": "Frames processed in parallel by the cv2 backend, 0 = one per CPU core; 1 processes frames one at a time with OpenCV's own threading"}),
+                "keep_float": ("BOOLEAN", {"default": False, "tooltip": "Run the cv2 backend on float32 frames instead of quantising to 8 bits"}),
+            }
         }
 
     RETURN_TYPES = ("IMAGE",)
@@ -43,32 +329,62 @@ class TTPlanet_Tile_Preprocessor_Simple:
     FUNCTION = 'process_image'
     CATEGORY = 'TTP/TILE'
 
-    def process_image(self, image, scale_factor, blur_strength):
+    # Frames sent to the device at once, to bound VRAM on long videos
+    TORCH_CHUNK_SIZE = 16
+
+    def process_image(self, image, scale_factor, blur_strength, backend="cv2", cv2_workers=0, keep_float=False):
+        if backend == "torch":
+            return self.process_torch(image, scale_factor, blur_strength)
+        return self.process_cv2(image, scale_factor, blur_strength, cv2_workers, keep_float)
+
+    def process_torch(self, image, scale_factor, blur_strength):
+        device = comfy.model_management.get_torch_device()
+        height, width = image.shape[1:3]
+        new_size = (int(height / scale_factor), int(width / scale_factor))
+
         ret_images = []
-    
-        for i in image:
-            # Convert tensor to PIL for processing
-            _canvas = tensor2pil(torch.unsqueeze(i, 0)).convert('RGB')
-        
-            # Convert PIL image to OpenCV format
-            img_np = np.array(_canvas)[:, :, ::-1]  # RGB to BGR
-        
-            # Resize image first if you want blur to apply after resizing
-            height, width = img_np.shape[:2]
-            new_width = int(width / scale_factor)
-            new_height = int(height / scale_factor)
-            resized_down = cv2.resize(img_np, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            resized_img = cv2.resize(resized_down, (width, height), interpolation=cv2.INTER_LINEAR)
-        
-            # Apply Gaussian blur after resizing
-            img_np = apply_gaussian_blur(resized_img, ksize=int(blur_strength), sigmaX=blur_strength / 2)
-        
-            # Convert OpenCV back to PIL and then to tensor
-            _canvas = Image.fromarray(img_np[:, :, ::-1])  # BGR to RGB
-            tensor_img = pil2tensor(_canvas)
-            ret_images.append(tensor_img)
-    
-        return (torch.cat(ret_images, dim=0),)        
+        for chunk in image.split(self.TORCH_CHUNK_SIZE):
+            x = chunk[..., :3].movedim(-1, 1).to(device=device, dtype=torch.float32)
+            # INTER_AREA down, INTER_LINEAR back up, then blur, all on the whole chunk
+            x = resize_area_torch(x, new_size)
+            x = F.interpolate(x, size=(height, width), mode="bilinear", align_corners=False)
+            x = apply_gaussian_blur_torch(x, ksize=int(blur_strength), sigmaX=blur_strength / 2)
+            ret_images.append(x.clamp_(0, 1).movedim(1, -1).to(comfy.model_management.intermediate_device()))
+
+        return (torch.cat(ret_images, dim=0),)
+
+    def process_frame_cv2(self, i, scale_factor, blur_strength, keep_float=False):
+        # Resize and blur treat channels independently, so no BGR flip is needed
+        img_np = tensor2np(i[..., :3], keep_float)
+
+        # Resize image first if you want blur to apply after resizing
+        height, width = img_np.shape[:2]
+        new_width = int(width / scale_factor)
+        new_height = int(height / scale_factor)
+        resized_down = cv2.resize(img_np, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        resized_img = cv2.resize(resized_down, (width, height), interpolation=cv2.INTER_LINEAR)
+
+        # Apply Gaussian blur after resizing
+        img_np = apply_gaussian_blur(resized_img, ksize=int(blur_strength), sigmaX=blur_strength / 2)
+
+        return np2tensor(img_np)
+
+    def process_cv2(self, image, scale_factor, blur_strength, workers=0, keep_float=False):
+        workers = min(workers or os.cpu_count() or 1, image.shape[0])
+        if workers <= 1:
+            ret_images = [self.process_frame_cv2(i, scale_factor, blur_strength, keep_float) for i in image]
+        else:
+            # cv2.resize / GaussianBlur release the GIL; map() keeps the frame order.
+            # OpenCV's own worker threads would compete with the pool, so it runs single-threaded meanwhile
+            cv2_threads = cv2.getNumThreads()
+            cv2.setNumThreads(1)
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    ret_images = list(executor.map(lambda i: self.process_frame_cv2(i, scale_factor, blur_strength, keep_float), image))
+            finally:
+                cv2.setNumThreads(cv2_threads)
+
+        return (torch.cat(ret_images, dim=0),)
 
 
 class TTP_Image_Tile_Batch:
@@ -82,54 +398,70 @@ class TTP_Image_Tile_Batch:
                 "image": ("IMAGE",),
                 "tile_width": ("INT", {"default": 1024, "min": 1}),
                 "tile_height": ("INT", {"default": 1024, "min": 1}),
+            },
+            "optional": {
+                "storage": (["memory", "disk"], {"default": "memory", "tooltip": "disk keeps the tile batch in a memory-mapped scratch file that is paged in on demand"}),
+                "grid_mode": (["fixed", "planned"], {"default": "fixed", "tooltip": "planned treats tile_width/height as an upper bound and picks the cheapest grid"}),
+                "min_overlap": ("INT", {"default": 64, "min": 0, "step": 8}),
+                "align": ("INT", {"default": 8, "min": 1, "max": 64, "step": 1, "tooltip": "Planned tile sizes are multiples of this (8 or 16 for latent alignment)"}),
+                "detail_metric": (["none", "variance", "laplacian"], {"default": "none", "tooltip": "Score each tile and list only the detailed ones in ACTIVE_INDICES"}),
+                "detail_threshold": ("FLOAT", {"default": 0.002, "min": 0.0, "max": 1.0, "step": 0.0005, "tooltip": "Tiles scoring below this are left to the plain resample"}),
             }
         }
 
-    RETURN_TYPES = ("IMAGE", "LIST", "TUPLE", "TUPLE")
-    RETURN_NAMES = ("IMAGES", "POSITIONS", "ORIGINAL_SIZE", "GRID_SIZE")
+    RETURN_TYPES = ("IMAGE", "LIST", "TUPLE", "TUPLE", "INT", "LIST")
+    RETURN_NAMES = ("IMAGES", "POSITIONS", "ORIGINAL_SIZE", "GRID_SIZE", "SAMPLER_PASSES", "ACTIVE_INDICES")
     FUNCTION = "tile_image"
 
     CATEGORY = "TTP/Image"
 
-    def tile_image(self, image, tile_width=1024, tile_height=1024):
-        image = tensor2pil(image.squeeze(0))
-        img_width, img_height = image.size
+    def tile_image(self, image, tile_width=1024, tile_height=1024, storage="memory", grid_mode="fixed", min_overlap=64, align=8,
+                   detail_metric="none", detail_threshold=0.002):
+        tiles, positions, original_size, grid_size = self.tile_grid(image, tile_width, tile_height, storage, grid_mode, min_overlap, align)
+        if detail_metric == "none":
+            active_indices = list(range(tiles.shape[0]))
+        else:
+            scores = tile_detail_scores(tiles, detail_metric)
+            active_indices = [i for i, score in enumerate(scores.tolist()) if score >= detail_threshold]
+        return (tiles, positions, original_size, grid_size, len(active_indices), active_indices)
 
-        if img_width <= tile_width and img_height <= tile_height:
-            return (pil2tensor(image), [(0, 0, img_width, img_height)], (img_width, img_height), (1, 1))
+    def tile_grid(self, image, tile_width, tile_height, storage="memory", grid_mode="fixed", min_overlap=64, align=8):
+        num_frames, img_height, img_width = image.shape[:3]
 
-        def calculate_step(size, tile_size):
-            if size <= tile_size:
-                return 1, 0
-            else:
-                num_tiles = (size + tile_size - 1) // tile_size
-                overlap = (num_tiles * tile_size - size) // (num_tiles - 1)
-                step = tile_size - overlap
-                return num_tiles, step
+        def frame_positions(grid_positions):
+            # Tiles are flattened frame-major (N x rows x cols); multi-image positions carry the frame index
+            if num_frames == 1:
+                return list(grid_positions)
+            return [(*pos, frame) for frame in range(num_frames) for pos in grid_positions]
 
-        num_cols, step_x = calculate_step(img_width, tile_width)
-        num_rows, step_y = calculate_step(img_height, tile_height)
+        if img_width <= tile_width and img_height <= tile_height:
+            return (image, frame_positions([(0, 0, img_width, img_height)]), (img_width, img_height), (1, 1))
 
-        tiles = []
-        positions = []
-        for y in range(num_rows):
-            for x in range(num_cols):
-                left = x * step_x
-                upper = y * step_y
-                right = min(left + tile_width, img_width)
-                lower = min(upper + tile_height, img_height)
-
-                if right - left < tile_width:
-                    left = max(0, img_width - tile_width)
-                if lower - upper < tile_height:
-                    upper = max(0, img_height - tile_height)
-
-                tile = image.crop((left, upper, right, lower))
-                tile_tensor = pil2tensor(tile)
-                tiles.append(tile_tensor)
-                positions.append((left, upper, right, lower))
-
-        tiles = torch.stack(tiles, dim=0).squeeze(1)
+        if grid_mode == "planned":
+            tile_width, lefts = plan_tile_axis(img_width, tile_width, min_overlap, align)
+            tile_height, uppers = plan_tile_axis(img_height, tile_height, min_overlap, align)
+        else:
+            lefts = fixed_tile_starts(img_width, tile_width)
+            uppers = fixed_tile_starts(img_height, tile_height)
+        num_cols, num_rows = len(lefts), len(uppers)
+
+        positions = frame_positions([
+            (left, upper, min(left + tile_width, img_width), min(upper + tile_height, img_height))
+            for upper in uppers for left in lefts
+        ])
+
+        # Gather all tiles of all frames straight from the float tensor: one copy, no 8-bit round trip
+        crop_height, crop_width = min(tile_height, img_height), min(tile_width, img_width)
+        ys, xs = tile_grid_index(uppers, lefts, crop_height, crop_width, device=image.device)
+        if storage == "disk":
+            tiles = torch.from_numpy(scratch_memmap((num_frames * num_rows * num_cols, crop_height, crop_width, image.shape[-1]), prefix="ttp_tiles_"))
+            # Fill one row of tiles at a time so only a single band is ever materialised in RAM
+            for frame in range(num_frames):
+                for row in range(num_rows):
+                    start = (frame * num_rows + row) * num_cols
+                    tiles[start:start + num_cols] = image[frame][ys[row], xs[0]]
+        else:
+            tiles = image[:, ys, xs].reshape(-1, crop_height, crop_width, image.shape[-1])
         return (tiles, positions, (img_width, img_height), (num_cols, num_rows))
 
 
@@ -146,6 +478,12 @@ class TTP_Image_Assy:
                 "original_size": ("TUPLE",),
                 "grid_size": ("TUPLE",),
                 "padding": ("INT", {"default": 64, "min": 0}),
+            },
+            "optional": {
+                "assembly_mode": (["tensor", "pil", "streaming"], {"default": "tensor"}),
+                "blend_curve": (["linear", "cosine", "smoothstep"], {"default": "linear"}),
+                "active_indices": ("LIST", {"tooltip": "Indices of the processed tiles when only ACTIVE_INDICES were sampled"}),
+                "fallback_image": ("IMAGE", {"tooltip": "Plain resample used for the tiles that were not sampled"}),
             }
         }
 
@@ -155,18 +493,11 @@ class TTP_Image_Assy:
 
     CATEGORY = "TTP/Image"
 
-    def create_gradient_mask(self, size, direction):
+    def create_gradient_mask(self, size, direction, curve="linear"):
         """Create a gradient mask for blending."""
-        mask = Image.new("L", size)
-        for i in range(size[0] if direction == 'horizontal' else size[1]):
-            value = int(255 * (1 - (i / size[0] if direction == 'horizontal' else i / size[1])))
-            if direction == 'horizontal':
-                mask.paste(value, (i, 0, i+1, size[1]))
-            else:
-                mask.paste(value, (0, i, size[0], i+1))
-        return mask
+        return gradient_mask(tuple(size), direction, curve)
 
-    def blend_tiles(self, tile1, tile2, overlap_size, direction, padding):
+    def blend_tiles(self, tile1, tile2, overlap_size, direction, padding, curve="linear"):
         """Blend two tiles with a smooth transition."""
         blend_size = padding
         if blend_size > overlap_size:
@@ -193,7 +524,7 @@ class TTP_Image_Assy:
         offset_right = offset_total - offset_left
 
         size = (blend_size, tile1.height) if direction == 'horizontal' else (tile1.width, blend_size)
-        mask = self.create_gradient_mask(size, direction)
+        mask = self.create_gradient_mask(size, direction, curve)
 
         if direction == 'horizontal':
             crop_tile1 = tile1.crop((tile1.width - overlap_size + offset_left, 0, tile1.width - offset_right, tile1.height))
@@ -212,7 +543,7 @@ class TTP_Image_Assy:
             offset_bottom = offset_total - offset_top
 
             size = (tile1.width, blend_size)
-            mask = self.create_gradient_mask(size, direction)
+            mask = self.create_gradient_mask(size, direction, curve)
 
             crop_tile1 = tile1.crop((0, tile1.height - overlap_size + offset_top, tile1.width, tile1.height - offset_bottom))
             crop_tile2 = tile2.crop((0, offset_top, tile2.width, offset_top + blend_size))
@@ -226,9 +557,95 @@ class TTP_Image_Assy:
             result.paste(tile2.crop((0, offset_top + blend_size, tile2.width, tile2.height)), (0, tile1.height - offset_bottom))
         return result
 
-    def assemble_image(self, tiles, positions, original_size, grid_size, padding):
+    def assemble_tensor(self, tiles, positions, original_size, grid_size, padding, curve="linear"):
+        """Accumulate weighted tiles into one preallocated float canvas and normalise once.
+
+        Every frame shares the same grid, so each grid slot is written for all frames at once.
+        """
+        num_cols, num_rows = grid_size
+        width, height = original_size
+        device = tiles.device
+        num_tiles = num_cols * num_rows
+        num_frames = tiles.shape[0] // num_tiles
+        frame_tiles = tiles.reshape(num_frames, num_tiles, *tiles.shape[1:])
+
+        output = torch.zeros((num_frames, height, width, tiles.shape[-1]), dtype=torch.float32, device=device)
+        weight = torch.zeros((height, width, 1), dtype=torch.float32, device=device)
+
+        row_spans = [(positions[row * num_cols][1], positions[row * num_cols][3]) for row in range(num_rows)]
+        row_weights = seam_weights(row_spans, padding, curve)
+        for row, (upper, lower) in enumerate(row_spans):
+            col_spans = [(positions[row * num_cols + col][0], positions[row * num_cols + col][2]) for col in range(num_cols)]
+            col_weights = seam_weights(col_spans, padding, curve)
+            for col, (left, right) in enumerate(col_spans):
+                tile = frame_tiles[:, row * num_cols + col, :lower - upper, :right - left].to(torch.float32)
+                tile_weight = (row_weights[row][:, None] * col_weights[col][None, :]).to(device).unsqueeze(-1)
+                output[:, upper:lower, left:right] += tile * tile_weight
+                weight[upper:lower, left:right] += tile_weight
+
+        output /= weight.clamp_(min=1e-6)
+        return (output,)
+
+    def assemble_streaming(self, tiles, positions, original_size, grid_size, padding, curve="linear"):
+        """Blend one row of tiles at a time into a memory-mapped canvas.
+
+        Only the current row band lives in RAM. The separable seam weights sum to one wherever
+        tiles cover the canvas, so each band is added straight into the file-backed output
+        without a full-size weight buffer. The returned IMAGE shares memory with that file.
+        """
+        num_cols, num_rows = grid_size
+        width, height = original_size
+        num_tiles = num_cols * num_rows
+        num_frames = tiles.shape[0] // num_tiles
+        frame_tiles = tiles.reshape(num_frames, num_tiles, *tiles.shape[1:])
+
+        output = torch.from_numpy(scratch_memmap((num_frames, height, width, tiles.shape[-1]), prefix="ttp_assy_"))
+
+        row_spans = [(positions[row * num_cols][1], positions[row * num_cols][3]) for row in range(num_rows)]
+        row_weights = seam_weights(row_spans, padding, curve)
+        for row, (upper, lower) in enumerate(row_spans):
+            col_spans = [(positions[row * num_cols + col][0], positions[row * num_cols + col][2]) for col in range(num_cols)]
+            col_weights = seam_weights(col_spans, padding, curve)
+            band = torch.zeros((num_frames, lower - upper, width, tiles.shape[-1]), dtype=torch.float32)
+            for col, (left, right) in enumerate(col_spans):
+                tile = frame_tiles[:, row * num_cols + col, :lower - upper, :right - left].to(device="cpu", dtype=torch.float32)
+                tile_weight = (row_weights[row][:, None] * col_weights[col][None, :]).unsqueeze(-1)
+                band[:, :, left:right] += tile * tile_weight
+            output[:, upper:lower] += band
+            del band
+
+        return (output,)
+
+    def fill_skipped_tiles(self, tiles, positions, original_size, active_indices, fallback_image):
+        """Complete a sparse tile batch: skipped tiles are cut from the resampled fallback image."""
+        if fallback_image is None:
+            raise ValueError(f"Got {tiles.shape[0]} tiles for {len(positions)} positions; connect fallback_image to fill the skipped tiles")
+        if len(active_indices) != tiles.shape[0]:
+            raise ValueError(f"The number of active indices ({len(active_indices)}) does not match the number of tiles ({tiles.shape[0]})")
+        width, height = original_size
+        if fallback_image.shape[1:3] != (height, width):
+            fallback_image = F.interpolate(fallback_image.movedim(-1, 1), size=(height, width), mode="bicubic", align_corners=False, antialias=True).movedim(1, -1).clamp_(0, 1)
+        full_tiles = gather_boxes(fallback_image.to(device=tiles.device, dtype=tiles.dtype), positions)
+        full_tiles[active_indices] = tiles
+        return full_tiles
+
+    def assemble_image(self, tiles, positions, original_size, grid_size, padding, assembly_mode="tensor", blend_curve="linear",
+                       active_indices=None, fallback_image=None):
+        if active_indices is not None and tiles.shape[0] < len(positions):
+            tiles = self.fill_skipped_tiles(tiles, positions, original_size, active_indices, fallback_image)
+        if assembly_mode == "tensor":
+            return self.assemble_tensor(tiles, positions, original_size, grid_size, padding, blend_curve)
+        if assembly_mode == "streaming":
+            return self.assemble_streaming(tiles, positions, original_size, grid_size, padding, blend_curve)
+        num_tiles = grid_size[0] * grid_size[1]
+        frames = [
+            self.assemble_pil(tiles[start:start + num_tiles], positions[start:start + num_tiles], original_size, grid_size, padding, blend_curve)[0]
+            for start in range(0, tiles.shape[0], num_tiles)
+        ]
+        return (torch.cat(frames, dim=0),)
+
+    def assemble_pil(self, tiles, positions, original_size, grid_size, padding, curve="linear"):
         num_cols, num_rows = grid_size
-        reconstructed_image = Image.new("RGB", original_size)
 
         # First, blend each row independently
         row_images = []
@@ -241,7 +658,7 @@ class TTP_Image_Assy:
                 left = positions[index][0]
                 overlap_width = prev_right - left
                 if overlap_width > 0:
-                    row_image = self.blend_tiles(row_image, tile_image, overlap_width, 'horizontal', padding)
+                    row_image = self.blend_tiles(row_image, tile_image, overlap_width, 'horizontal', padding, curve)
                 else:
                     # Adjust the size of row_image to accommodate the new tile
                     new_width = row_image.width + tile_image.width
@@ -259,7 +676,7 @@ class TTP_Image_Assy:
             upper = positions[row * num_cols][1]
             overlap_height = prev_lower - upper
             if overlap_height > 0:
-                final_image = self.blend_tiles(final_image, row_images[row], overlap_height, 'vertical', padding)
+                final_image = self.blend_tiles(final_image, row_images[row], overlap_height, 'vertical', padding, curve)
             else:
                 # Adjust the size of final_image to accommodate the new row image
                 new_width = max(final_image.width, row_images[row].width)
@@ -269,7 +686,539 @@ class TTP_Image_Assy:
                 new_final_image.paste(row_images[row], (0, final_image.height))
                 final_image = new_final_image
 
-        return pil2tensor(final_image).unsqueeze(0)
+        return (pil2tensor(final_image),)
+
+
+class TTP_Latent_Tile_Batch:
+    """Latent-space counterpart of TTP_Image_Tile_Batch.
+
+    Tiles a LATENT directly so a large upscale needs a single VAE encode. Tile sizes and the
+    returned positions are in pixels, so they plug into TTP_CoordinateSplitter unchanged.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "samples": ("LATENT",),
+                "tile_width": ("INT", {"default": 1024, "min": 8, "step": 8}),
+                "tile_height": ("INT", {"default": 1024, "min": 8, "step": 8}),
+            },
+            "optional": {
+                "compression": ("INT", {"default": 8, "min": 1, "max": 64, "step": 1, "tooltip": "Spatial compression of the VAE"}),
+                "grid_mode": (["fixed", "planned"], {"default": "fixed"}),
+                "min_overlap": ("INT", {"default": 64, "min": 0, "step": 8}),
+                "align": ("INT", {"default": 2, "min": 1, "max": 16, "step": 1, "tooltip": "Planned tile sizes are multiples of this many latent cells (2 for patch-2 DiTs such as Flux and SD3)"}),
+            }
+        }
+
+    RETURN_TYPES = ("LATENT", "LIST", "TUPLE", "TUPLE", "INT")
+    RETURN_NAMES = ("LATENTS", "POSITIONS", "ORIGINAL_SIZE", "GRID_SIZE", "SAMPLER_PASSES")
+    FUNCTION = "tile_latent"
+
+    CATEGORY = "TTP/Latent"
+
+    def tile_latent(self, samples, tile_width=1024, tile_height=1024, compression=8, grid_mode="fixed", min_overlap=64, align=2):
+        latent = samples["samples"]
+        num_frames = latent.shape[0]
+        lat_height, lat_width = latent.shape[-2:]
+        tile_w, tile_h = max(1, tile_width // compression), max(1, tile_height // compression)
+
+        if grid_mode == "planned":
+            overlap = -(-min_overlap // compression)
+            tile_w, lefts = plan_tile_axis(lat_width, tile_w, overlap, align)
+            tile_h, uppers = plan_tile_axis(lat_height, tile_h, overlap, align)
+        else:
+            lefts = fixed_tile_starts(lat_width, tile_w)
+            uppers = fixed_tile_starts(lat_height, tile_h)
+        tile_w, tile_h = min(tile_w, lat_width), min(tile_h, lat_height)
+        num_cols, num_rows = len(lefts), len(uppers)
+
+        grid_positions = [
+            (left * compression, upper * compression, (left + tile_w) * compression, (upper + tile_h) * compression)
+            for upper in uppers for left in lefts
+        ]
+        if num_frames == 1:
+            positions = grid_positions
+        else:
+            positions = [(*pos, frame) for frame in range(num_frames) for pos in grid_positions]
+
+        ys, xs = tile_grid_index(uppers, lefts, tile_h, tile_w, device=latent.device)
+
+        def gather(tensor):
+            # (B, C[, T], H, W) -> (B * rows * cols, C[, T], tile_h, tile_w)
+            tiles = tensor[..., ys, xs].movedim((-4, -3), (1, 2))
+            return tiles.reshape(-1, *tiles.shape[3:])
+
+        out = {k: v for k, v in samples.items() if k != "batch_index"}
+        out["samples"] = gather(latent)
+        if "noise_mask" in samples:
+            mask = samples["noise_mask"]
+            mask = mask.reshape(-1, 1, *mask.shape[-2:]).to(dtype=torch.float32)
+            if mask.shape[-2:] != (lat_height, lat_width):
+                mask = F.interpolate(mask, size=(lat_height, lat_width), mode="bilinear", align_corners=False)
+            out["noise_mask"] = gather(mask.expand(num_frames, -1, -1, -1))
+
+        original_size = (lat_width * compression, lat_height * compression)
+        return (out, positions, original_size, (num_cols, num_rows), out["samples"].shape[0])
+
+
+class TTP_Latent_Assy:
+    """Reassemble latent tiles with the same seam blending as TTP_Image_Assy, at latent resolution."""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "samples": ("LATENT",),
+                "positions": ("LIST",),
+                "original_size": ("TUPLE",),
+                "grid_size": ("TUPLE",),
+                "padding": ("INT", {"default": 64, "min": 0, "tooltip": "Blend width in pixels"}),
+            },
+            "optional": {
+                "compression": ("INT", {"default": 8, "min": 1, "max": 64, "step": 1}),
+                "blend_curve": (["linear", "cosine", "smoothstep"], {"default": "linear"}),
+            }
+        }
+
+    RETURN_TYPES = ("LATENT",)
+    RETURN_NAMES = ("RECONSTRUCTED_LATENT",)
+    FUNCTION = "assemble_latent"
+
+    CATEGORY = "TTP/Latent"
+
+    def assemble_latent(self, samples, positions, original_size, grid_size, padding, compression=8, blend_curve="linear"):
+        num_cols, num_rows = grid_size
+        width, height = original_size[0] // compression, original_size[1] // compression
+        padding = padding // compression
+        num_tiles = num_cols * num_rows
+        tile_h, tile_w = samples["samples"].shape[-2:]
+
+        row_spans = []
+        for row in range(num_rows):
+            upper = positions[row * num_cols][1] // compression
+            row_spans.append((upper, min(upper + tile_h, height)))
+        row_weights = seam_weights(row_spans, padding, blend_curve)
+        col_spans, col_weights = [], []
+        for row in range(num_rows):
+            spans = []
+            for col in range(num_cols):
+                left = positions[row * num_cols + col][0] // compression
+                spans.append((left, min(left + tile_w, width)))
+            col_spans.append(spans)
+            col_weights.append(seam_weights(spans, padding, blend_curve))
+
+        def assemble(tiles):
+            num_frames = tiles.shape[0] // num_tiles
+            frame_tiles = tiles.reshape(num_frames, num_tiles, *tiles.shape[1:])
+            output = torch.zeros((num_frames, *tiles.shape[1:-2], height, width), dtype=torch.float32, device=tiles.device)
+            weight = torch.zeros((height, width), dtype=torch.float32, device=tiles.device)
+            for row, (upper, lower) in enumerate(row_spans):
+                for col, (left, right) in enumerate(col_spans[row]):
+                    tile = frame_tiles[:, row * num_cols + col, ..., :lower - upper, :right - left].to(torch.float32)
+                    tile_weight = (row_weights[row][:, None] * col_weights[row][col][None, :]).to(tiles.device)
+                    output[..., upper:lower, left:right] += tile * tile_weight
+                    weight[upper:lower, left:right] += tile_weight
+            return (output / weight.clamp_(min=1e-6)).to(tiles.dtype)
+
+        out = {k: v for k, v in samples.items() if k != "batch_index"}
+        out["samples"] = assemble(samples["samples"])
+        if "noise_mask" in samples:
+            out["noise_mask"] = assemble(samples["noise_mask"])
+        return (out,)
+
+
+class TTP_Seam_Strips:
+    """Cut narrow strips around the tile seams of an assembled image for a cheap re-diffusion pass.
+
+    Strips of one direction share a size (strip_width x tile height for vertical seams, tile
+    width x strip_width for horizontal ones) so they sample as a single batch; run the node
+    once per direction. The mask is 1 over the central mask_width band and fades to 0 at the
+    strip edges, so it serves both as the inpaint mask and as the alpha for TTP_Seam_Composite.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "positions": ("LIST",),
+                "grid_size": ("TUPLE",),
+                "direction": (["vertical", "horizontal"], {"default": "vertical"}),
+                "strip_width": ("INT", {"default": 128, "min": 16, "step": 8}),
+                "mask_width": ("INT", {"default": 64, "min": 8, "step": 8}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "MASK", "LIST")
+    RETURN_NAMES = ("STRIPS", "STRIP_MASKS", "STRIP_POSITIONS")
+    FUNCTION = "seam_strips"
+
+    CATEGORY = "TTP/Image"
+
+    def seam_profile(self, size, center, mask_width):
+        """Cross-seam alpha: 1 over the band around `center`, linear fade to 0 at both strip edges."""
+        pos = torch.arange(size, dtype=torch.float32) + 0.5
+        half = mask_width / 2
+        ramp_in = pos / max(center - half, 1.0)
+        ramp_out = (size - pos) / max(size - center - half, 1.0)
+        return torch.minimum(ramp_in, ramp_out).clamp_(0, 1)
+
+    def seam_strips(self, image, positions, grid_size, direction="vertical", strip_width=128, mask_width=64):
+        num_cols, num_rows = grid_size
+        num_tiles = num_cols * num_rows
+        img_height, img_width = image.shape[1:3]
+        size = min(strip_width, img_width if direction == "vertical" else img_height)
+
+        strip_positions = []
+        profiles = []
+        for start in range(0, len(positions), num_tiles):
+            grid = [unpack_position(p) for p in positions[start:start + num_tiles]]
+            for row in range(num_rows):
+                for col in range(num_cols):
+                    frame, left, upper, right, lower = grid[row * num_cols + col]
+                    if direction == "vertical":
+                        if col == num_cols - 1:
+                            continue
+                        center = (grid[row * num_cols + col + 1][1] + right) // 2
+                        x0 = min(max(center - size // 2, 0), img_width - size)
+                        box = (x0, upper, x0 + size, lower)
+                        profiles.append(self.seam_profile(size, center - x0, mask_width)[None, :].expand(lower - upper, -1))
+                    else:
+                        if row == num_rows - 1:
+                            continue
+                        center = (grid[(row + 1) * num_cols + col][2] + lower) // 2
+                        y0 = min(max(center - size // 2, 0), img_height - size)
+                        box = (left, y0, right, y0 + size)
+                        profiles.append(self.seam_profile(size, center - y0, mask_width)[:, None].expand(-1, right - left))
+                    strip_positions.append((*box, frame) if len(positions[0]) == 5 else box)
+
+        if not strip_positions:
+            raise ValueError(f"The {grid_size[0]}x{grid_size[1]} grid has no {direction} seams")
+
+        return (gather_boxes(image, strip_positions), torch.stack(profiles), strip_positions)
+
+
+class TTP_Seam_Composite:
+    """Blend re-sampled seam strips back into the assembled image using their strip masks."""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "strips": ("IMAGE",),
+                "strip_positions": ("LIST",),
+                "strip_masks": ("MASK",),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("IMAGE",)
+    FUNCTION = "composite_strips"
+
+    CATEGORY = "TTP/Image"
+
+    def composite_strips(self, image, strips, strip_positions, strip_masks):
+        if strips.shape[0] != len(strip_positions):
+            raise ValueError(f"Got {strips.shape[0]} strips for {len(strip_positions)} strip positions")
+
+        output = image.clone()
+        for i, position in enumerate(strip_positions):
+            frame, left, upper, right, lower = unpack_position(position)
+            strip = strips[i].to(output)
+            if strip.shape[:2] != (lower - upper, right - left):
+                # The sampler may have resized the strip
+                strip = F.interpolate(strip.movedim(-1, 0)[None], size=(lower - upper, right - left), mode="bilinear", align_corners=False)[0].movedim(0, -1)
+            alpha = strip_masks[i].reshape(lower - upper, right - left, 1).to(output)
+            region = output[frame, upper:lower, left:right]
+            output[frame, upper:lower, left:right] = region + (strip - region) * alpha
+        return (output,)
+
+
+class TTP_Tile_Select:
+    """Keep only the tiles listed in ACTIVE_INDICES, with their positions, for sampling."""
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "images": ("IMAGE",),
+                "positions": ("LIST",),
+                "active_indices": ("LIST",),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "LIST")
+    RETURN_NAMES = ("IMAGES", "POSITIONS")
+    FUNCTION = "select_tiles"
+
+    CATEGORY = "TTP/Image"
+
+    def select_tiles(self, images, positions, active_indices):
+        if not active_indices:
+            raise ValueError("No tile passed the detail threshold; lower detail_threshold or use the fallback image directly")
+        return (images[active_indices], [positions[i] for i in active_indices])
+
+
+def _hash_update(h, value):
+    """Feed tensors, conditioning dicts/lists and plain values into a hash deterministically."""
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu().contiguous()
+        h.update(f"{value.dtype}{tuple(value.shape)}".encode())
+        h.update(value.reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            h.update(str(key).encode())
+            _hash_update(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _hash_update(h, item)
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        h.update(repr(value).encode())
+    else:
+        # Models, control nets etc.: reprs carry memory addresses, so only the type is stable
+        h.update(type(value).__name__.encode())
+
+
+def _sample_patch_data(value, num_values):
+    """Patch data with every tensor cut to its first `num_values` elements, for hashing."""
+    if isinstance(value, torch.Tensor):
+        return value.detach().reshape(-1)[:num_values]
+    if isinstance(value, (list, tuple)):
+        return [_sample_patch_data(item, num_values) for item in value]
+    if hasattr(value, "weights"):
+        # Weight adapter objects (LoRA, LoHa, ...) keep their tensors in `weights`
+        return [type(value).__name__, _sample_patch_data(value.weights, num_values)]
+    return value
+
+
+def model_patcher_hash(model_patcher, num_weights=16, num_values=4096):
+    """Identify a MODEL (checkpoint plus its LoRA/patch stack) without hashing every weight.
+
+    A fixed, evenly spaced subset of diffusion model weights is hashed (the unpatched copies where
+    the patcher holds a backup), together with every patched key, its strengths and the first
+    values of each patch tensor, so two LoRAs on the same keys hash differently, and the
+    object patches.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    state = model_patcher.model.state_dict()
+    keys = sorted(k for k in state if k.startswith("diffusion_model."))
+    backup = getattr(model_patcher, "backup", {})
+    for key in keys[::max(1, len(keys) // num_weights)][:num_weights]:
+        weight = backup[key].weight if key in backup else state[key]
+        h.update(key.encode())
+        _hash_update(h, weight.detach().reshape(-1)[:num_values])
+    for key in sorted(model_patcher.patches):
+        h.update(key.encode())
+        _hash_update(h, [(patch[0], patch[2], _sample_patch_data(patch[1], num_values)) for patch in model_patcher.patches[key]])
+    # Object patches such as the model sampling of ModelSamplingSD3/Flux carry their settings as buffers
+    object_patches = getattr(model_patcher, "object_patches", {})
+    for key in sorted(object_patches):
+        value = object_patches[key]
+        h.update(key.encode())
+        _hash_update(h, value.state_dict() if isinstance(value, torch.nn.Module) else value)
+    return h.hexdigest()
+
+
+class TileCache:
+    """Size-bounded LRU store of sampled tiles on local disk, keyed by content hash."""
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.index_path = os.path.join(directory, "index.json")
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.entries = {key: entry for key, entry in self.entries.items() if os.path.exists(self.path(key))}
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def contains(self, key):
+        return key in self.entries and os.path.exists(self.path(key))
+
+    def get(self, key):
+        if not self.contains(key):
+            return None
+        self.entries[key]["used"] = time.time()
+        return torch.from_numpy(np.load(self.path(key)).astype(np.float32))
+
+    def put(self, key, tile):
+        # float16 halves the disk footprint while staying well above 8-bit precision
+        np.save(self.path(key), tile.detach().cpu().to(torch.float16).numpy())
+        self.entries[key] = {"size": os.path.getsize(self.path(key)), "used": time.time()}
+
+    def evict(self):
+        total = self.total_bytes()
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)["size"]
+            _remove_file(self.path(key))
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def stats(self):
+        return f"tile cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} tiles, {self.total_bytes() / 2**20:.1f} MB"
+
+
+_TILE_CACHES = {}
+
+DEFAULT_TILE_CACHE_DIR = os.path.join(folder_paths.get_user_directory(), "ttp_toolset", "tile_cache")
+
+
+def get_tile_cache(cache_dir, max_cache_mb):
+    cache_dir = os.path.abspath(cache_dir or DEFAULT_TILE_CACHE_DIR)
+    if cache_dir not in _TILE_CACHES:
+        _TILE_CACHES[cache_dir] = TileCache(cache_dir, max_cache_mb * 2**20)
+    cache = _TILE_CACHES[cache_dir]
+    cache.max_bytes = max_cache_mb * 2**20
+    return cache
+
+
+class TTP_Tile_Cache_Lookup:
+    """Look up sampled tiles by a hash of everything the sampler result depends on.
+
+    The key covers the tile pixels, the model with its patches, positive and negative
+    conditioning, seed, steps, cfg, sampler, scheduler and denoise, so changing any of them
+    misses the cache. Wire the same values into the sampler. Only the misses go on to the
+    sampler; TTP_Tile_Cache_Store merges them back with the hits. When every tile hits,
+    MISS_TILES holds one placeholder tile, but the store node does not request the sampled
+    tiles then, so the sampler branch is never run.
+    """
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "tiles": ("IMAGE",),
+                "model": ("MODEL",),
+                "positive": ("CONDITIONING", {"tooltip": "One entry per tile (e.g. from TTP_cond to batch) or a single shared conditioning"}),
+                "negative": ("CONDITIONING", {"tooltip": "One entry per tile or a single shared conditioning"}),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
+                "steps": ("INT", {"default": 20, "min": 1, "max": 10000}),
+                "cfg": ("FLOAT", {"default": 8.0, "min": 0.0, "max": 100.0, "step": 0.1, "round": 0.01}),
+                "sampler_name": (comfy.samplers.KSampler.SAMPLERS,),
+                "scheduler": (comfy.samplers.KSampler.SCHEDULERS,),
+                "denoise": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.01}),
+            },
+            "optional": {
+                "extra_key": ("STRING", {"default": "", "multiline": False, "tooltip": "Anything else outside these inputs that changes the result, e.g. the VAE or a ControlNet"}),
+                "cache_dir": ("STRING", {"default": ""}),
+                "max_cache_mb": ("INT", {"default": 4096, "min": 1, "max": 1 << 20}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "CONDITIONING", "CONDITIONING", "LIST", "LIST")
+    RETURN_NAMES = ("MISS_TILES", "MISS_POSITIVE", "MISS_NEGATIVE", "MISS_INDICES", "CACHE_KEYS")
+    FUNCTION = "lookup"
+
+    CATEGORY = "TTP/Image"
+
+    def lookup(self, tiles, model, positive, negative, seed, steps, cfg, sampler_name, scheduler, denoise,
+               extra_key="", cache_dir="", max_cache_mb=4096):
+        cache = get_tile_cache(cache_dir, max_cache_mb)
+        num_tiles = tiles.shape[0]
+        per_tile = {name: len(cond) == num_tiles for name, cond in (("positive", positive), ("negative", negative))}
+
+        shared = hashlib.blake2b(digest_size=16)
+        shared.update(model_patcher_hash(model).encode())
+        _hash_update(shared, (seed, steps, cfg, sampler_name, scheduler, denoise, extra_key))
+        for name, cond in (("positive", positive), ("negative", negative)):
+            shared.update(f"{name}:{'per tile' if per_tile[name] else 'shared'}".encode())
+            if not per_tile[name]:
+                _hash_update(shared, cond)
+
+        keys = []
+        for i in range(num_tiles):
+            h = shared.copy()
+            _hash_update(h, tiles[i])
+            if per_tile["positive"]:
+                _hash_update(h, positive[i])
+            if per_tile["negative"]:
+                _hash_update(h, negative[i])
+            keys.append(h.hexdigest())
+
+        miss_indices = [i for i, key in enumerate(keys) if not cache.contains(key)]
+        cache.misses += len(miss_indices)
+        cache.hits += len(keys) - len(miss_indices)
+
+        sample_indices = miss_indices or [0]
+        miss_positive = [positive[i] for i in sample_indices] if per_tile["positive"] else positive
+        miss_negative = [negative[i] for i in sample_indices] if per_tile["negative"] else negative
+        return (tiles[sample_indices], miss_positive, miss_negative, miss_indices, keys)
+
+
+class TTP_Tile_Cache_Store:
+    """Store freshly sampled tiles and rebuild the full tile batch from cache hits plus new samples."""
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "sampled_tiles": ("IMAGE", {"lazy": True, "tooltip": "Only evaluated when some tile missed the cache"}),
+                "miss_indices": ("LIST",),
+                "cache_keys": ("LIST",),
+            },
+            "optional": {
+                "cache_dir": ("STRING", {"default": ""}),
+                "max_cache_mb": ("INT", {"default": 4096, "min": 1, "max": 1 << 20}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("TILES", "CACHE_STATS")
+    FUNCTION = "store"
+
+    CATEGORY = "TTP/Image"
+
+    def check_lazy_status(self, miss_indices, sampled_tiles=None, **kwargs):
+        # On a full cache hit the sampler output is never requested, so ComfyUI skips the sampler
+        if miss_indices and sampled_tiles is None:
+            return ["sampled_tiles"]
+        return []
+
+    def store(self, sampled_tiles, miss_indices, cache_keys, cache_dir="", max_cache_mb=4096):
+        cache = get_tile_cache(cache_dir, max_cache_mb)
+        if miss_indices and sampled_tiles.shape[0] != len(miss_indices):
+            raise ValueError(f"Got {sampled_tiles.shape[0]} sampled tiles for {len(miss_indices)} cache misses")
+
+        # Read the hits before storing anything so eviction cannot drop a tile this run needs
+        sampled = dict(zip(miss_indices, sampled_tiles)) if miss_indices else {}
+        tiles = []
+        for i, key in enumerate(cache_keys):
+            tile = sampled.get(i)
+            if tile is None:
+                tile = cache.get(key)
+                if tile is None:
+                    raise RuntimeError(f"Tile {i} was a cache hit but is no longer in {cache.directory}")
+            tiles.append(tile if sampled_tiles is None else tile.to(sampled_tiles))
+
+        for i in miss_indices:
+            cache.put(cache_keys[i], sampled[i])
+        cache.evict()
+        cache.save()
+        return (torch.stack(tiles), cache.stats())
 
 
 class TTP_CoordinateSplitter:
@@ -288,19 +1237,138 @@ class TTP_CoordinateSplitter:
     CATEGORY = "TTP/Conditioning"
     
     def split_coordinates(self, Positions):
-        coordinates = []
-        for i, coords in enumerate(Positions):
-            if len(coords) != 4:
-                raise ValueError(f"Coordinate group {i+1} must contain exactly 4 values, but got {len(coords)}")
-            
-            x, y, x2, y2 = coords
-            width = x2 - x
-            height = y2 - y
-            coordinates.append((x, y, width, height))  # Create a tuple for each coordinate group
-        
-        return (coordinates,)  # Return as a tuple containing a list of tuples
+        # One (x, y, width, height) tuple per tile
+        return (positions_to_boxes(Positions),)
+
+
+
+def positions_to_boxes(positions):
+    """(x, y, width, height) pixel boxes for (left, upper, right, lower[, frame]) tile positions."""
+    for i, coords in enumerate(positions):
+        if len(coords) not in (4, 5):
+            raise ValueError(f"Coordinate group {i+1} must contain 4 values (or 5 with a frame index), but got {len(coords)}")
+    corners = np.array([coords[:4] for coords in positions], dtype=np.int64).reshape(-1, 4)
+    corners[:, 2:] -= corners[:, :2]
+    return [tuple(box) for box in corners.tolist()]
+
+
+@functools.lru_cache(maxsize=32)
+def _latent_areas(boxes, spatial_compression, latent_frames):
+    b = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+    s = spatial_compression
+    # Starts and sizes both round down, so equal tiles keep equal areas and ComfyUI can batch them
+    x0, y0 = b[:, 0] // s, b[:, 1] // s
+    w, h = b[:, 2] // s, b[:, 3] // s
+    if latent_frames:
+        t, zero = np.full_like(x0, latent_frames), np.zeros_like(x0)
+        areas = np.stack([t, h, w, zero, y0, x0], axis=1)
+    else:
+        areas = np.stack([h, w, y0, x0], axis=1)
+    return tuple(tuple(area) for area in areas.tolist())
+
+
+def latent_areas(coordinates, spatial_compression=8, frames=0, temporal_compression=4):
+    """Latent conditioning areas for pixel (x, y, width, height) boxes, all tiles in one NumPy op.
+
+    Returns (h, w, y, x) tuples for image latents. For video latents (frames > 0) the areas are
+    (t, h, w, t0, y, x) spanning every latent frame of a causal VAE with the given temporal
+    compression, e.g. 4 for HunyuanVideo. Results are cached per grid.
+    """
+    latent_frames = (frames - 1) // temporal_compression + 1 if frames > 0 else 0
+    boxes = tuple(tuple(int(v) for v in coord) for coord in coordinates)
+    return list(_latent_areas(boxes, spatial_compression, latent_frames))
+
+
+LATENT_COMPRESSION_INPUTS = {
+    "spatial_compression": ("INT", {"default": 8, "min": 1, "max": 64, "step": 1, "tooltip": "Pixels per latent cell (8 for SD/Flux VAEs, 16 for some DiT VAEs)"}),
+    "frames": ("INT", {"default": 0, "min": 0, "max": 4096, "step": 1, "tooltip": "Pixel frames of a video latent, 0 for images"}),
+    "temporal_compression": ("INT", {"default": 4, "min": 1, "max": 16, "step": 1}),
+}
 
 
+def set_conditioning_areas(conditionings, areas, strength):
+    """Tag each conditioning entry with its latent area in one pass.
+
+    Same result as node_helpers.conditioning_set_values per entry: the embedding tensors are
+    shared by reference and only the option dicts are copied.
+    """
+    return [
+        [cond[0], {**cond[1], "area": area, "strength": strength, "set_area_to_bounds": False}]
+        for cond, area in zip(conditionings, areas)
+    ]
+
+
+def latent_canvas_size(coordinates, spatial_compression=8):
+    """(height, width) of the latent the VAE encodes from the pixel canvas the tiles cover."""
+    height = max(coord[1] + coord[3] for coord in coordinates)
+    width = max(coord[0] + coord[2] for coord in coordinates)
+    return height // spatial_compression, width // spatial_compression
+
+
+def _option_identity(value):
+    """Hashable stand-in for a conditioning option: plain values by value, objects and tensors by identity."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_option_identity(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted(((str(key), _option_identity(item)) for key, item in value.items()), key=lambda item: item[0]))
+    return id(value)
+
+
+def dedupe_conditioning_areas(conditionings, areas, strength, latent_size):
+    """Merge entries that share an embedding into one masked conditioning.
+
+    Tiles with identical prompts and otherwise identical options (control, gligen...) become a
+    single entry whose mask is the union of their areas, so the sampler evaluates that context
+    once per step (cropped to the union's bounds) instead of once per area. A group is only
+    merged when those bounds are no larger than its areas added up; far-apart tiles keep their
+    plain areas, as do entries with a unique embedding or a mask of their own. Masks are sized
+    to the true latent (height, width) so ComfyUI uses them without resampling.
+    """
+    fingerprints = {}
+    groups = {}
+    for i, cond in enumerate(conditionings):
+        identity = (id(cond[0]), id(cond[1].get("pooled_output")))
+        if identity not in fingerprints:
+            h = hashlib.blake2b(digest_size=16)
+            _hash_update(h, (cond[0], cond[1].get("pooled_output"), cond[1].get("guidance")))
+            fingerprints[identity] = h.hexdigest()
+        options = {k: v for k, v in cond[1].items() if k not in ("pooled_output", "guidance", "area")}
+        groups.setdefault((fingerprints[identity], _option_identity(options)), []).append(i)
+
+    if any(len(area) != 4 for area in areas):
+        logger.warning("Conditioning dedupe only supports image latents, keeping one area per entry")
+        return set_conditioning_areas(conditionings, areas, strength)
+
+    height, width = latent_size
+
+    combined = []
+    for indices in groups.values():
+        cond = conditionings[indices[0]]
+        group_areas = np.array([areas[i] for i in indices], dtype=np.int64)
+        bounds_h = (group_areas[:, 0] + group_areas[:, 2]).max() - group_areas[:, 2].min()
+        bounds_w = (group_areas[:, 1] + group_areas[:, 3]).max() - group_areas[:, 3].min()
+        # A merged entry carries the union as its mask, so entries with a mask of their own stay apart
+        if len(indices) == 1 or "mask" in cond[1] or bounds_h * bounds_w > (group_areas[:, 0] * group_areas[:, 1]).sum():
+            combined.extend(set_conditioning_areas([conditionings[i] for i in indices], [areas[i] for i in indices], strength))
+            continue
+        mask = torch.zeros((1, height, width), dtype=torch.float32)
+        for i in indices:
+            h, w, y, x = areas[i]
+            mask[:, y:y + h, x:x + w] = 1.0
+        options = {k: v for k, v in cond[1].items() if k != "area"}
+        options.update({"mask": mask, "mask_strength": strength, "set_area_to_bounds": True})
+        combined.append([cond[0], options])
+    logger.debug("Deduplicated %d conditionings into %d entries", len(conditionings), len(combined))
+    return combined
+
+
+def _check_coordinates(coordinates):
+    for coord in coordinates:
+        if len(coord) != 4:
+            raise ValueError(f"Each coordinate should have exactly 4 values, but got {len(coord)}")
+
 
 class TTP_condtobatch:
     @classmethod
@@ -320,7 +1388,7 @@ class TTP_condtobatch:
 
     def combine_to_batch(self, conditionings):
         # 直接将所有conditioning组合在一起并返回
-        combined_conditioning = sum(conditionings, [])
+        combined_conditioning = list(itertools.chain.from_iterable(conditionings))
         return (combined_conditioning,)
         
         
@@ -332,6 +1400,10 @@ class TTP_condsetarea_merge:
                 "conditioning_batch": ("CONDITIONING", {"forceInput": True}),
                 "coordinates": ("LIST", {"forceInput": True}),
                 "strength": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 10.0, "step": 0.01}),
+            },
+            "optional": {
+                "dedupe": ("BOOLEAN", {"default": False, "tooltip": "Merge tiles with identical prompts into one masked conditioning"}),
+                **LATENT_COMPRESSION_INPUTS,
             }
         }
 
@@ -340,40 +1412,21 @@ class TTP_condsetarea_merge:
 
     CATEGORY = "TTP/Conditioning"
 
-    def apply_coordinates_to_batch(self, conditioning_batch, coordinates, strength):
+    def apply_coordinates_to_batch(self, conditioning_batch, coordinates, strength, dedupe=False,
+                                   spatial_compression=8, frames=0, temporal_compression=4):
         # 确保coordinates和conditioning_batch的数量一致
         if len(coordinates) != len(conditioning_batch):
             raise ValueError(f"The number of coordinates ({len(coordinates)}) does not match the number of conditionings ({len(conditioning_batch)})")
 
-        updated_conditionings = []
-
-        # 遍历每个conditioning和相应的coordinate
-        for conditioning, coord in zip(conditioning_batch, coordinates):
-            if len(coord) != 4:
-                raise ValueError(f"Each coordinate should have exactly 4 values, but got {len(coord)}")
+        _check_coordinates(coordinates)
+        areas = latent_areas(coordinates, spatial_compression, frames, temporal_compression)
+        logger.debug("TTP_condsetarea_merge areas: %s", areas)
 
-            x, y, width, height = coord
-
-            # Print x, y, width, height for debugging
-            print(f"Processing coordinate - x: {x}, y: {y}, width: {width}, height: {height}")
-
-            # 将每个 conditioning 处理为列表格式
-            single_conditioning = [conditioning]
-
-            # 使用标准的 node_helpers.conditioning_set_values 方法进行区域设置
-            updated_conditioning = node_helpers.conditioning_set_values(
-                single_conditioning,
-                {
-                    "area": (height // 8, width // 8, y // 8, x // 8),
-                    "strength": strength,
-                    "set_area_to_bounds": False,
-                }
-            )
-
-            updated_conditionings.append(updated_conditioning)
-
-        # 将所有更新后的conditioning重新组合为一个batch
-        combined_conditioning = sum(updated_conditionings, [])
+        # 一次性为所有 conditioning 设置区域
+        if dedupe:
+            latent_size = latent_canvas_size(coordinates, spatial_compression)
+            return (dedupe_conditioning_areas(conditioning_batch, areas, strength, latent_size),)
+        combined_conditioning = set_conditioning_areas(conditioning_batch, areas, strength)
         return (combined_conditioning,)
 
 class TTP_condsetarea_merge_test:
@@ -385,6 +1438,10 @@ class TTP_condsetarea_merge_test:
                 "coordinates": ("LIST", {"forceInput": True}),
                 "group_size": ("INT", {"default": 1, "min": 1, "step": 1}),
                 "strength": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 10.0, "step": 0.01}),
+            },
+            "optional": {
+                "dedupe": ("BOOLEAN", {"default": False, "tooltip": "Merge repeated or identical prompts into one masked conditioning"}),
+                **LATENT_COMPRESSION_INPUTS,
             }
         }
 
@@ -393,7 +1450,8 @@ class TTP_condsetarea_merge_test:
 
     CATEGORY = "TTP/Conditioning"
 
-    def apply_coordinates_to_batch(self, conditioning_batch, coordinates, group_size, strength):
+    def apply_coordinates_to_batch(self, conditioning_batch, coordinates, group_size, strength, dedupe=False,
+                                   spatial_compression=8, frames=0, temporal_compression=4):
         import math
 
         # 计算 conditioning 中的组数
@@ -416,42 +1474,93 @@ class TTP_condsetarea_merge_test:
         if len(coordinates) != required_coords:
             raise ValueError(f"The number of coordinates ({len(coordinates)}) does not match the required number ({required_coords}) based on group size ({group_size}) and conditioning length ({num_conditionings})")
 
-        updated_conditionings = []
-        conditioning_index = 0
-
-        # 遍历坐标和分组
-        for coord in coordinates:
-            if len(coord) != 4:
-                raise ValueError(f"Each coordinate should have exactly 4 values, but got {len(coord)}")
-
-            x, y, width, height = coord
-
-            # 打印调试信息
-            print(f"Processing coordinate - x: {x}, y: {y}, width: {width}, height: {height}")
+        _check_coordinates(coordinates)
+        areas = latent_areas(coordinates, spatial_compression, frames, temporal_compression)
+        logger.debug("TTP_condsetarea_merge_test areas: %s", areas)
+
+        # 每组 conditioning 共用同一个区域
+        group_conditionings = conditioning_batch[:len(coordinates) * group_size]
+        group_areas = [area for area in areas for _ in range(group_size)]
+        if dedupe:
+            latent_size = latent_canvas_size(coordinates, spatial_compression)
+            return (dedupe_conditioning_areas(group_conditionings, group_areas, strength, latent_size),)
+        combined_conditioning = set_conditioning_areas(group_conditionings, group_areas, strength)
+        return (combined_conditioning,)
 
-            # 获取当前组的 conditioning
-            group_conditionings = conditioning_batch[conditioning_index:conditioning_index + group_size]
+        
+class TTP_Regional_Prompt_Batch:
+    """Pack every tile prompt into one conditioning with a regional joint-attention mask.
+
+    All tile contexts are concatenated into a single text sequence. The mask lets each prompt's
+    tokens and the image tokens of its tile attend to each other, while image tokens still see the
+    whole image, so the sampler runs one forward per step whatever the number of tiles. It needs a
+    model whose ComfyUI wrapper consumes `attention_mask` (the Flux family); the mask holds
+    (text + image tokens)^2 entries, so keep the latent moderate.
+    """
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "conditioning_batch": ("CONDITIONING", {"forceInput": True}),
+                "coordinates": ("LIST", {"forceInput": True}),
+                "latent": ("LATENT",),
+            },
+            "optional": {
+                "spatial_compression": ("INT", {"default": 8, "min": 1, "max": 64, "step": 1}),
+                "patch_size": ("INT", {"default": 2, "min": 1, "max": 8, "step": 1, "tooltip": "Latent cells per image token side (2 for Flux)"}),
+            }
+        }
 
-            for conditioning in group_conditionings:
-                # 使用标准的 node_helpers.conditioning_set_values 方法进行区域设置
-                updated_conditioning = node_helpers.conditioning_set_values(
-                    [conditioning],
-                    {
-                        "area": (height // 8, width // 8, y // 8, x // 8),
-                        "strength": strength,
-                        "set_area_to_bounds": False,
-                    }
-                )
+    RETURN_TYPES = ("CONDITIONING",)
+    FUNCTION = "pack_regions"
 
-                updated_conditionings.append(updated_conditioning)
+    CATEGORY = "TTP/Conditioning"
 
-            conditioning_index += group_size
+    def pack_regions(self, conditioning_batch, coordinates, latent, spatial_compression=8, patch_size=2):
+        if len(coordinates) != len(conditioning_batch):
+            raise ValueError(f"The number of coordinates ({len(coordinates)}) does not match the number of conditionings ({len(conditioning_batch)})")
+        _check_coordinates(coordinates)
+
+        lat_height, lat_width = latent["samples"].shape[-2:]
+        tok_height, tok_width = -(-lat_height // patch_size), -(-lat_width // patch_size)
+        num_img_tokens = tok_height * tok_width
+
+        contexts = [cond[0] for cond in conditioning_batch]
+        context = torch.cat(contexts, dim=1)
+        num_txt_tokens = context.shape[1]
+        size = num_txt_tokens + num_img_tokens
+
+        # True = may attend; text comes first in the joint sequence
+        allowed = torch.zeros((size, size), dtype=torch.bool)
+        allowed[num_txt_tokens:, num_txt_tokens:] = True
+        token_areas = latent_areas(coordinates, spatial_compression * patch_size)
+        txt_start = 0
+        for ctx, (h, w, y, x) in zip(contexts, token_areas):
+            txt = slice(txt_start, txt_start + ctx.shape[1])
+            region = torch.zeros((tok_height, tok_width), dtype=torch.bool)
+            region[y:y + h, x:x + w] = True
+            img = num_txt_tokens + region.flatten().nonzero().squeeze(1)
+            allowed[txt, txt] = True
+            allowed[txt, img] = True
+            allowed[img, txt] = True
+            txt_start += ctx.shape[1]
+
+        # Additive form; ComfyUI casts float conds to the model dtype before the forward
+        mask = torch.zeros((1, size, size), dtype=torch.float16)
+        mask[0].masked_fill_(~allowed, float("-inf"))
+        del allowed
+
+        options = {k: v for k, v in conditioning_batch[0][1].items() if k not in ("area", "mask", "strength", "set_area_to_bounds")}
+        pooled = [cond[1]["pooled_output"] for cond in conditioning_batch if cond[1].get("pooled_output") is not None]
+        if pooled:
+            options["pooled_output"] = torch.stack(pooled).mean(dim=0)
+        options["attention_mask"] = mask
+        options["attention_mask_img_shape"] = (tok_height, tok_width)
+        logger.debug("Packed %d regional prompts into %d text tokens over a %dx%d token grid",
+                     len(contexts), num_txt_tokens, tok_height, tok_width)
+        return ([[context, options]],)
 
-        # 将所有更新后的 conditioning 重新组合为一个批次
-        combined_conditioning = sum(updated_conditionings, [])
-        return (combined_conditioning,)
 
-        
 class Tile_imageSize:
     @classmethod
     def INPUT_TYPES(cls):
@@ -461,17 +1570,27 @@ class Tile_imageSize:
                 "width_factor": ("INT", {"default": 3, "min": 1, "max": 10, "step": 1}),
                 "height_factor": ("INT", {"default": 3, "min": 1, "max": 10, "step": 1}),
                 "overlap_rate": ("FLOAT", {"default": 0.1, "min": 0.00, "max": 0.95, "step": 0.05}),
+            },
+            "optional": {
+                "mode": (["factor", "planned"], {"default": "factor", "tooltip": "planned sizes the tiles for the given grid from min_overlap instead of overlap_rate"}),
+                "min_overlap": ("INT", {"default": 64, "min": 0, "step": 8}),
+                "align": ("INT", {"default": 8, "min": 1, "max": 64, "step": 1}),
             }
         }
 
-    RETURN_TYPES = ("INT", "INT")
-    RETURN_NAMES = ("tile_width", "tile_height")
+    RETURN_TYPES = ("INT", "INT", "INT")
+    RETURN_NAMES = ("tile_width", "tile_height", "sampler_passes")
     CATEGORY = "TTP/Image"
     FUNCTION = "image_width_height"
 
-    def image_width_height(self, image, width_factor, height_factor, overlap_rate):
-        _, raw_H, raw_W, _ = image.shape
-        if overlap_rate == 0:
+    def image_width_height(self, image, width_factor, height_factor, overlap_rate, mode="factor", min_overlap=64, align=8):
+        batch, raw_H, raw_W, _ = image.shape
+        if mode == "planned":
+            # Smallest aligned tiles that cover the image with the requested grid and overlap
+            tile_width, _ = plan_tile_axis(raw_W, raw_W, min_overlap, align, num_tiles=width_factor)
+            tile_height, _ = plan_tile_axis(raw_H, raw_H, min_overlap, align, num_tiles=height_factor)
+
+        elif overlap_rate == 0:
             # 水平方向
             if width_factor == 1:
                 tile_width = raw_W
@@ -503,7 +1622,14 @@ class Tile_imageSize:
                 if tile_height % 8 != 0:
                     tile_height = (tile_height // 8) * 8
 
-        return (tile_width, tile_height)
+        if tile_width < 8 or tile_height < 8:
+            raise ValueError(f"A {raw_W}x{raw_H} image is too small for a {width_factor}x{height_factor} grid at overlap {overlap_rate}: "
+                             f"tiles would be {tile_width}x{tile_height}, below the 8 px minimum")
+
+        # Passes TTP_Image_Tile_Batch will produce for these tiles in fixed mode, which may differ
+        # from the requested grid (e.g. planned tiles with a large min_overlap)
+        passes = batch * len(fixed_tile_starts(raw_W, tile_width)) * len(fixed_tile_starts(raw_H, tile_height))
+        return (tile_width, tile_height, passes)
         
 class TTP_Expand_And_Mask:
     """
@@ -514,6 +1640,7 @@ class TTP_Expand_And_Mask:
     2. 分别控制每个方向的扩展块数量。
     3. 将输入图像的透明通道（Alpha 通道）信息转换为蒙版，并与新创建的蒙版合并。
     4. 添加一个布尔参数 fill_alpha_decision 来决定是否将输出图片中的透明区域填充为指定颜色，并输出 RGB 图像。
+    5. expand_mode 可改为按像素或按原图比例扩展，结果向上取整到 snap（潜空间倍数），feather 在原图边缘生成羽化蒙版带。
     """
     def __init__(self, *args, **kwargs):
         pass
@@ -531,6 +1658,11 @@ class TTP_Expand_And_Mask:
             "optional": {
                 **{f"expand_{dir}": ("BOOLEAN", {"default": False, "label": f"Expand {dir.capitalize()}"}) for dir in directions},
                 **{f"num_blocks_{dir}": ("INT", {"default": 1, "min": 0, "max": 3, "step": 1, "label": f"Blocks {dir.capitalize()}"}) for dir in directions},
+                "expand_mode": (["blocks", "pixels", "ratio"], {"default": "blocks", "tooltip": "Expand each side by whole image blocks, by pixels, or by a fraction of the image size"}),
+                **{f"pixels_{dir}": ("INT", {"default": 64, "min": 0, "max": 8192, "step": 8, "label": f"Pixels {dir.capitalize()}"}) for dir in directions},
+                **{f"ratio_{dir}": ("FLOAT", {"default": 0.25, "min": 0.0, "max": 3.0, "step": 0.05, "label": f"Ratio {dir.capitalize()}"}) for dir in directions},
+                "snap": ("INT", {"default": 8, "min": 1, "max": 128, "step": 1, "tooltip": "Round each pixel/ratio expansion up to this multiple (the VAE latent cell)"}),
+                "feather": ("INT", {"default": 0, "min": 0, "max": 1024, "step": 1, "tooltip": "Width of a soft mask band reaching into the original image along expanded sides"}),
             }
         }
 
@@ -558,158 +1690,76 @@ class TTP_Expand_And_Mask:
         else:
             raise ValueError("Invalid hex color format")
 
-    def expand_and_mask(self, image, fill_mode="duplicate", fill_alpha_decision=False, fill_color="#7F7F7F", **kwargs):
-        pil_image = tensor2pil(image)
-        orig_width, orig_height = pil_image.size
-        has_alpha = (pil_image.mode == 'RGBA')
-
-        # 解析方向和块数
-        directions = ["left", "right", "top", "bottom"]
-        expand_directions = {dir: kwargs.get(f"expand_{dir}", False) for dir in directions}
-        num_blocks = {dir: kwargs.get(f"num_blocks_{dir}", 0) if expand_directions[dir] else 0 for dir in directions}
-
-        # 计算扩展后的尺寸
-        total_width = orig_width + orig_width * (num_blocks["left"] + num_blocks["right"])
-        total_height = orig_height + orig_height * (num_blocks["top"] + num_blocks["bottom"])
-
-        # 创建扩展后的图像
-        expanded_image_mode = pil_image.mode
-        expanded_image = Image.new(expanded_image_mode, (total_width, total_height))
-
-        # 根据 fill_mode 创建填充图像
-        def create_fill_image():
-            if pil_image.mode == 'RGBA':
-                return Image.new("RGBA", (orig_width, orig_height), color=(255, 255, 255, 255))
-            elif pil_image.mode == 'RGB':
-                return Image.new("RGB", (orig_width, orig_height), color=(255, 255, 255))
-            elif pil_image.mode == 'L':
-                return Image.new("L", (orig_width, orig_height), color=255)
+    def side_padding(self, orig_width, orig_height, expand_mode="blocks", snap=8, **kwargs):
+        """Pixels to add on each side; pixel and ratio expansions are rounded up to a multiple of `snap`."""
+        padding = {}
+        for dir in ["left", "right", "top", "bottom"]:
+            length = orig_width if dir in ("left", "right") else orig_height
+            if not kwargs.get(f"expand_{dir}", False):
+                pad = 0
+            elif expand_mode == "pixels":
+                pad = kwargs.get(f"pixels_{dir}", 0)
+            elif expand_mode == "ratio":
+                pad = int(np.ceil(kwargs.get(f"ratio_{dir}", 0.0) * length))
             else:
-                raise ValueError(f"Unsupported image mode for fill: {pil_image.mode}")
-
+                padding[dir] = length * kwargs.get(f"num_blocks_{dir}", 0)
+                continue
+            padding[dir] = -(-pad // snap) * snap
+        return padding
+
+    def expand_and_mask(self, image, fill_mode="duplicate", fill_alpha_decision=False, fill_color="#7F7F7F", feather=0, **kwargs):
+        # 整批处理：image 为 (B, H, W, C)，C 为 4 时最后一个通道是透明度
+        batch, orig_height, orig_width, channels = image.shape
+        has_alpha = channels == 4
+
+        # 每个方向扩展的像素数
+        padding = self.side_padding(orig_width, orig_height, **kwargs)
+        total_width = orig_width + padding["left"] + padding["right"]
+        total_height = orig_height + padding["top"] + padding["bottom"]
+
+        # 原图在扩展图像中的位置
+        left_offset, top_offset = padding["left"], padding["top"]
+        inner = (slice(None), slice(top_offset, top_offset + orig_height), slice(left_offset, left_offset + orig_width))
+
+        # 复制模式下画布是以原图位置为基准的平铺，任意尺寸都按取模索引裁出；否则先铺白色再放入原图
         if fill_mode == "duplicate":
-            fill_image = pil_image.copy()
-        elif fill_mode == "white":
-            fill_image = create_fill_image()
+            ys = (torch.arange(total_height, device=image.device) - top_offset) % orig_height
+            xs = (torch.arange(total_width, device=image.device) - left_offset) % orig_width
+            expanded = image[:, ys[:, None], xs[None, :]]
         else:
-            fill_image = pil_image.copy()
-
-        # 计算原图在扩展图像中的位置
-        left_offset = orig_width * num_blocks["left"]
-        top_offset = orig_height * num_blocks["top"]
-
-        # 粘贴原始图像
-        expanded_image.paste(pil_image, (left_offset, top_offset))
-
-        # 粘贴填充区域
-        for dir in directions:
-            blocks = num_blocks[dir]
-            for i in range(blocks):
-                if dir == "left":
-                    x = left_offset - orig_width * (i + 1)
-                    y = top_offset
-                elif dir == "right":
-                    x = left_offset + orig_width * (i + 1)
-                    y = top_offset
-                elif dir == "top":
-                    x = left_offset
-                    y = top_offset - orig_height * (i + 1)
-                elif dir == "bottom":
-                    x = left_offset
-                    y = top_offset + orig_height * (i + 1)
-                else:
+            expanded = image.new_ones((batch, total_height, total_width, channels))
+            expanded[inner] = image
+
+        # 蒙版：扩展区域为 1.0，原图区域为 1 - alpha（无透明通道时为 0）
+        mask = image.new_ones((batch, total_height, total_width))
+        inner_mask = 1.0 - image[..., 3] if has_alpha else image.new_zeros((batch, orig_height, orig_width))
+
+        # 羽化：沿扩展边向原图内部渐变，与透明度蒙版取最大值
+        if feather > 0:
+            band_x = image.new_zeros(orig_width)
+            band_y = image.new_zeros(orig_height)
+            for dir, band in (("left", band_x), ("right", band_x), ("top", band_y), ("bottom", band_y)):
+                if padding[dir] == 0:
                     continue
-                expanded_image.paste(fill_image, (x, y))
-
-        # 粘贴角落填充区域（处理同时选择多个方向的情况）
-        corner_positions = []
-        if expand_directions["left"] and expand_directions["top"]:
-            for i in range(num_blocks["left"]):
-                for j in range(num_blocks["top"]):
-                    x = left_offset - orig_width * (i + 1)
-                    y = top_offset - orig_height * (j + 1)
-                    corner_positions.append((x, y))
-        if expand_directions["left"] and expand_directions["bottom"]:
-            for i in range(num_blocks["left"]):
-                for j in range(num_blocks["bottom"]):
-                    x = left_offset - orig_width * (i + 1)
-                    y = top_offset + orig_height * (j + 1)
-                    corner_positions.append((x, y))
-        if expand_directions["right"] and expand_directions["top"]:
-            for i in range(num_blocks["right"]):
-                for j in range(num_blocks["top"]):
-                    x = left_offset + orig_width * (i + 1)
-                    y = top_offset - orig_height * (j + 1)
-                    corner_positions.append((x, y))
-        if expand_directions["right"] and expand_directions["bottom"]:
-            for i in range(num_blocks["right"]):
-                for j in range(num_blocks["bottom"]):
-                    x = left_offset + orig_width * (i + 1)
-                    y = top_offset + orig_height * (j + 1)
-                    corner_positions.append((x, y))
-
-        for pos in corner_positions:
-            expanded_image.paste(fill_image, pos)
-
-        # 创建蒙版
-        mask_array = np.zeros((total_height, total_width), dtype=np.float32)
-
-        # 原始图像区域蒙版处理
-        if has_alpha:
-            alpha_array = np.array(pil_image.getchannel("A"), dtype=np.float32) / 255.0
-            alpha_mask_array = 1.0 - alpha_array
-            mask_array[top_offset:top_offset + orig_height, left_offset:left_offset + orig_width] = alpha_mask_array
-
-        # 填充区域蒙版设置为1.0
-        # 左右扩展区域
-        for dir in ["left", "right"]:
-            blocks = num_blocks[dir]
-            for i in range(blocks):
-                if dir == "left":
-                    x_start = left_offset - orig_width * (i + 1)
-                    x_end = left_offset - orig_width * i
-                elif dir == "right":
-                    x_start = left_offset + orig_width * (i + 1)
-                    x_end = left_offset + orig_width * (i + 2)
-                else:
-                    continue
-                mask_array[top_offset:top_offset + orig_height, x_start:x_end] = 1.0
-
-        # 上下扩展区域
-        for dir in ["top", "bottom"]:
-            blocks = num_blocks[dir]
-            for i in range(blocks):
-                if dir == "top":
-                    y_start = top_offset - orig_height * (i + 1)
-                    y_end = top_offset - orig_height * i
-                elif dir == "bottom":
-                    y_start = top_offset + orig_height * (i + 1)
-                    y_end = top_offset + orig_height * (i + 2)
-                else:
-                    continue
-                mask_array[y_start:y_end, left_offset:left_offset + orig_width] = 1.0
-
-        # 角落区域蒙版设置为1.0
-        for pos in corner_positions:
-            x, y = pos
-            mask_array[y:y + orig_height, x:x + orig_width] = 1.0
-
-        # 创建蒙版张量 (1, 1, height, width)
-        mask_tensor = torch.from_numpy(mask_array).unsqueeze(0).unsqueeze(0)
-
-        # 根据 fill_alpha_decision 参数决定是否将输出图像中的透明区域填充为指定颜色
+                width = min(feather, band.shape[0])
+                ramp = torch.from_numpy(gradient_ramp(width).astype(np.float32)).to(band)
+                if dir in ("right", "bottom"):
+                    ramp = ramp.flip(0)
+                edge = slice(0, width) if dir in ("left", "top") else slice(band.shape[0] - width, None)
+                band[edge] = torch.maximum(band[edge], ramp)
+            inner_mask = torch.maximum(inner_mask, torch.maximum(band_y[:, None], band_x[None, :]))
+        mask[inner] = inner_mask
+
+        # 与 Image.alpha_composite(背景色, 图像) 后转 RGB 等价的浮点计算
         if fill_alpha_decision and has_alpha:
-            expanded_image = expanded_image.convert('RGBA')  # 确保图像是RGBA模式
-            # 使用自定义填充颜色代替纯白色
-            fill_rgba = self.hex_to_rgba(fill_color)
-            background = Image.new('RGBA', expanded_image.size, fill_rgba)
-            expanded_image = Image.alpha_composite(background, expanded_image)
-            expanded_image = expanded_image.convert('RGB')  # 转换为RGB模式
-            expanded_image_mode = 'RGB'
-
-        expanded_image_tensor = pil2tensor(expanded_image)
-
-        return (expanded_image_tensor, mask_tensor)
+            fill = torch.tensor(self.hex_to_rgba(fill_color), dtype=expanded.dtype, device=expanded.device) / 255.0
+            rgb, alpha = expanded[..., :3], expanded[..., 3:]
+            back_weight = fill[3] * (1.0 - alpha)
+            out_alpha = alpha + back_weight
+            expanded = (rgb * alpha + fill[:3] * back_weight) / out_alpha.clamp(min=1e-8)
+            expanded = torch.where(out_alpha > 0, expanded, torch.zeros_like(expanded))
+
+        return (expanded, mask)
         
 class TTP_text_mix:
     def __init__(self, *args, **kwargs):
@@ -737,11 +1787,11 @@ class TTP_text_mix:
 
         return (text1, text2, text3, final_text)
 
-def horner_poly(x: torch.Tensor, coefficients: torch.Tensor) -> torch.Tensor:
+def horner_poly(x: torch.Tensor, coefficients) -> torch.Tensor:
     """
     使用 Horner's scheme 计算多项式:
       c[0]*x^(n-1) + c[1]*x^(n-2) + ... + c[n-2]*x + c[n-1]
-    其中 coefficients = [c[0], c[1], ..., c[n-1]].
+    其中 coefficients = [c[0], c[1], ..., c[n-1]]，为 Python 浮点数，避免逐个索引设备张量。
     """
     out = torch.zeros_like(x)
     for c in coefficients:
@@ -780,39 +1830,298 @@ def modulate(x, shift, scale):
     except Exception as e:
         raise RuntimeError(f"Modulation failed: {str(e)}")
 
-def modulate(x, shift, scale):
-    """Modulate layer implementation for HunyuanVideo"""
-    try:
-        # Ensure consistent data types
-        shift = shift.to(dtype=x.dtype, device=x.device)
-        scale = scale.to(dtype=x.dtype, device=x.device)
-        
-        # Reshape shift and scale to match x dimensions
-        B = x.shape[0]  # batch size
-        
-        if len(x.shape) == 3:  # [B, L, D]
-            shift = shift.view(B, 1, -1)  # [B, 1, D]
-            scale = scale.view(B, 1, -1)  # [B, 1, D]
-            shift = shift.expand(-1, x.shape[1], -1)  # [B, L, D]
-            scale = scale.expand(-1, x.shape[1], -1)  # [B, L, D]
-        elif len(x.shape) == 5:  # [B, C, T, H, W]
-            shift = shift.view(B, -1, 1, 1, 1)  # [B, C, 1, 1, 1]
-            scale = scale.view(B, -1, 1, 1, 1)  # [B, C, 1, 1, 1]
-            shift = shift.expand(-1, -1, x.shape[2], x.shape[3], x.shape[4])  # [B, C, T, H, W]
-            scale = scale.expand(-1, -1, x.shape[2], x.shape[3], x.shape[4])  # [B, C, T, H, W]
-        else:
-            raise ValueError(f"Unsupported input shape: {x.shape}")
-        
-        # Step-by-step calculation to reduce memory usage
-        result = x.mul_(1 + scale)  # in-place operation
-        result.add_(shift)  # in-place operation
-        
-        return result
-        
-    except Exception as e:
-        raise RuntimeError(f"Modulation failed: {str(e)}")
+class TeaCacheAdapter(abc.ABC):
+    """How TeaCache probes one diffusion model architecture.
+
+    `probe` returns the embedded image tokens, the modulation vector and the first block's modulated
+    input, from which the step-to-step rel-L1 distance is measured. `coefficients` rescale that
+    distance (highest power first, None for the raw distance), and `speeds`/`thresholds` map a
+    requested speedup to an accumulated-distance threshold. Adapters that set `embed_input` let the
+    full forward reuse the probe's embedding, and those with `supports_residual` can cache the
+    transformer-block residual instead of the model output.
+    """
+    name = None
+    class_names = ()
+    coefficients = None
+    speeds = [1.0, 1.6, 2.1, 3.2, 4.4]
+    thresholds = [0.0, 0.1, 0.15, 0.25, 0.35]
+    supports_residual = False
+
+    @staticmethod
+    def forward_arg(args, kwargs, index, name):
+        """A diffusion model forward argument, whether it was passed by position or by keyword."""
+        if name in kwargs:
+            return kwargs[name]
+        return args[index] if len(args) > index else None
+
+    @staticmethod
+    def split_modulation(modulation_output):
+        """(shift, scale) of the first modulation in the formats the block implementations return."""
+        if isinstance(modulation_output, tuple):
+            if len(modulation_output) < 1:
+                raise ValueError("Empty modulation output")
+            first = modulation_output[0]
+            if hasattr(first, 'shift') and hasattr(first, 'scale'):
+                return first.shift, first.scale
+            if len(modulation_output) < 2:
+                raise ValueError(f"Tuple too short, expected at least 2 elements, got {len(modulation_output)}")
+            return modulation_output[0], modulation_output[1]
+        if hasattr(modulation_output, 'shift') and hasattr(modulation_output, 'scale'):
+            return modulation_output.shift, modulation_output.scale
+        if hasattr(modulation_output, 'chunk'):
+            chunks = modulation_output.chunk(6, dim=-1)
+            return chunks[0], chunks[1]
+        raise ValueError(f"Unsupported modulation output format: {type(modulation_output)}")
+
+    @staticmethod
+    def modulated_input(norm, img, shift, scale, stride=1):
+        # 归一化与调制都不改动 img，无需复制；LayerNorm 和调制都是逐 token 的，子采样后的结果与全量结果的对应部分一致
+        if not isinstance(shift, torch.Tensor) or not isinstance(scale, torch.Tensor):
+            raise ValueError("Failed to get tensor values for shift and scale")
+        inp = img[:, ::stride] if stride > 1 else img
+        return modulate(norm(inp), shift=shift, scale=scale)
+
+    def with_profile(self, profile):
+        """A copy of this adapter using the coefficients and speed table of a calibration profile."""
+        adapter = copy.copy(self)
+        adapter.coefficients = profile["coefficients"]
+        adapter.speeds = profile["speeds"]
+        adapter.thresholds = profile["thresholds"]
+        return adapter
+
+    def residual_compatible(self, args, kwargs):
+        """Whether a skipped step may rebuild this call's output from the cached residual."""
+        return self.supports_residual
+
+    def embed_input(self, args, kwargs):
+        """The tensor the full forward passes to `embed_module`, or None when it is derived inside the forward."""
+        return None
+
+    def embed_module(self, transformer):
+        return None
+
+    def final_layer(self, transformer):
+        return None
+
+    @abc.abstractmethod
+    def probe(self, transformer, args, kwargs, stride=1):
+        """(embedded image tokens, modulation vector, first block's modulated input) for one forward call."""
+
+    @abc.abstractmethod
+    def unpatchify(self, transformer, img, shape):
+        """Final layer tokens back to a latent of `shape`."""
+
+
+class HunyuanVideoTeaCacheAdapter(TeaCacheAdapter):
+    name = "hunyuan_video"
+    class_names = ("HunyuanVideo",)
+    coefficients = [7.33226126e+02, -4.01131952e+02, 6.75869174e+01, -3.14987800e+00, 9.61237896e-02]
+    supports_residual = True
+
+    def residual_compatible(self, args, kwargs):
+        # I2V 引导帧和参考 latent 会改变 final_layer 的调制（modulation_dims）和 token 数，只能缓存输出
+        return kwargs.get("guiding_frame_index") is None and kwargs.get("ref_latent") is None
+
+    def embed_input(self, args, kwargs):
+        return self.forward_arg(args, kwargs, 0, "x")
+
+    def embed_module(self, transformer):
+        return transformer.img_in
+
+    def final_layer(self, transformer):
+        return transformer.final_layer
+
+    def probe(self, transformer, args, kwargs, stride=1):
+        x = self.forward_arg(args, kwargs, 0, "x")
+        timestep = self.forward_arg(args, kwargs, 1, "timestep")
+        y = self.forward_arg(args, kwargs, 3, "y")
+        guidance = self.forward_arg(args, kwargs, 4, "guidance")
+
+        # HunyuanVideo 使用 timestep_embedding 进行时间步编码，vector_in 处理 y
+        vec = transformer.time_in(comfy.ldm.flux.layers.timestep_embedding(timestep, 256, time_factor=1.0).to(x.dtype))
+        if y is not None:
+            vec = vec + transformer.vector_in(y[:, :transformer.params.vec_in_dim])
+        if guidance is not None and transformer.params.guidance_embed:
+            vec = vec + transformer.guidance_in(comfy.ldm.flux.layers.timestep_embedding(guidance, 256).to(x.dtype))
+
+        img = transformer.img_in(x)
+        block = transformer.double_blocks[0]
+        shift, scale = self.split_modulation(block.img_mod(vec))
+        return img, vec, self.modulated_input(block.img_norm1, img, shift, scale, stride)
+
+    def unpatchify(self, transformer, img, shape):
+        """(B, L, C * patch volume) final layer tokens back to a (B, C, T, H, W) latent, as in HunyuanVideo.forward_orig"""
+        B, _, T, H, W = shape
+        pt, ph, pw = transformer.patch_size
+        img = img.reshape(B, T // pt, H // ph, W // pw, transformer.out_channels, pt, ph, pw)
+        img = img.permute(0, 4, 1, 5, 2, 6, 3, 7)
+        return img.reshape(B, transformer.out_channels, T, H, W)
+
+
+class FluxTeaCacheAdapter(TeaCacheAdapter):
+    """Flux and models built on its double/single-stream blocks; coefficients and speeds from the TeaCache4FLUX calibration."""
+    name = "flux"
+    class_names = ("Flux",)
+    coefficients = [4.98651651e+02, -2.83781631e+02, 5.58554382e+01, -3.82021401e+00, 2.64230861e-01]
+    speeds = [1.0, 1.5, 1.8, 2.0, 2.25]
+    thresholds = [0.0, 0.25, 0.4, 0.6, 0.8]
+
+    def probe(self, transformer, args, kwargs, stride=1):
+        x = self.forward_arg(args, kwargs, 0, "x")
+        timestep = self.forward_arg(args, kwargs, 1, "timestep")
+        y = self.forward_arg(args, kwargs, 3, "y")
+        guidance = self.forward_arg(args, kwargs, 4, "guidance")
+
+        # 与 Flux.forward 相同的分块：(B, C, H, W) -> (B, h * w, C * p * p)
+        p = transformer.patch_size
+        B, C, H, W = x.shape
+        x = F.pad(x, (0, (-W) % p, 0, (-H) % p), mode="circular")
+        h, w = x.shape[2] // p, x.shape[3] // p
+        img = x.reshape(B, C, h, p, w, p).permute(0, 2, 4, 1, 3, 5).reshape(B, h * w, C * p * p)
+        img = transformer.img_in(img)
+
+        vec = transformer.time_in(comfy.ldm.flux.layers.timestep_embedding(timestep, 256).to(img.dtype))
+        if guidance is not None and transformer.params.guidance_embed:
+            vec = vec + transformer.guidance_in(comfy.ldm.flux.layers.timestep_embedding(guidance, 256).to(img.dtype))
+        if y is not None:
+            vec = vec + transformer.vector_in(y[:, :transformer.params.vec_in_dim])
+
+        block = transformer.double_blocks[0]
+        shift, scale = self.split_modulation(block.img_mod(vec))
+        return img, vec, self.modulated_input(block.img_norm1, img, shift, scale, stride)
+
+    def unpatchify(self, transformer, img, shape):
+        """(B, h * w, C * p * p) tokens back to (B, C, H, W), undoing the padding as Flux.forward does"""
+        B, C, H, W = shape
+        p = transformer.patch_size
+        h, w = -(-H // p), -(-W // p)
+        img = img.reshape(B, h, w, C, p, p).permute(0, 3, 1, 4, 2, 5).reshape(B, C, h * p, w * p)
+        return img[:, :, :H, :W]
+
+
+class SD3TeaCacheAdapter(TeaCacheAdapter):
+    """SD3/SD3.5 MMDiT. There are no calibrated coefficients, so the raw distance is used and the
+    speed table is only a rough starting point; output caching only."""
+    name = "sd3"
+    class_names = ("MMDiT",)
+    speeds = [1.0, 1.5, 2.0]
+    thresholds = [0.0, 0.05, 0.1]
+
+    def probe(self, transformer, args, kwargs, stride=1):
+        x = self.forward_arg(args, kwargs, 0, "x")
+        timestep = self.forward_arg(args, kwargs, 1, "timesteps")
+        y = self.forward_arg(args, kwargs, 3, "y")
+
+        vec = transformer.t_embedder(timestep, dtype=x.dtype)
+        if y is not None and transformer.y_embedder is not None:
+            vec = vec + transformer.y_embedder(y)
+        # 有意省略位置编码：它在各步之间不变，只会给距离的分母加上同一个偏移；
+        # SD3 没有校准系数，这个偏差由 calibrate 生成的配置一并吸收
+        img = transformer.x_embedder(x)
+
+        block = transformer.joint_blocks[0].x_block
+        modulation = block.adaLN_modulation(vec)
+        shift, scale = modulation.chunk(modulation.shape[-1] // img.shape[-1], dim=-1)[:2]
+        return img, vec, self.modulated_input(block.norm1, img, shift, scale, stride)
+
+    def unpatchify(self, transformer, img, shape):
+        """Final layer tokens back to (B, C, H, W) with MMDiT's own unpatchify, cropped like its forward"""
+        H, W = shape[-2:]
+        return transformer.unpatchify(img, hw=(H, W))[:, :, :H, :W]
+
+
+TEACACHE_ADAPTERS = {adapter.name: adapter for adapter in (HunyuanVideoTeaCacheAdapter(), FluxTeaCacheAdapter(), SD3TeaCacheAdapter())}
+
+
+def get_teacache_adapter(diffusion_model, model_type="auto"):
+    """The adapter for `model_type`, or the one matching the closest class in the diffusion model's MRO."""
+    if model_type != "auto":
+        return TEACACHE_ADAPTERS[model_type]
+    for cls in type(diffusion_model).__mro__:
+        for adapter in TEACACHE_ADAPTERS.values():
+            if cls.__name__ in adapter.class_names:
+                return adapter
+    raise ValueError(f"TeaCache has no adapter for {type(diffusion_model).__name__}, supported: {', '.join(TEACACHE_ADAPTERS)}")
+
+
+TEACACHE_PRESET_SPEEDS = {
+    "Original (1x)": 1.0,
+    "Fast (1.6x)": 1.6,
+    "Faster (2.1x)": 2.1,
+    "Ultra Fast (3.2x)": 3.2,
+    "Shapeless Fast (4.4x)": 4.4,
+}
+
+TEACACHE_PROFILE_DIR = os.path.join(folder_paths.get_user_directory(), "ttp_toolset", "teacache_profiles")
+
+
+def relative_l1(current, previous):
+    return (current - previous).abs().mean() / (previous.abs().mean() + 1e-6)
+
+
+def teacache_profile_key(model_hash, latent_shape):
+    """Profiles are per model and latent size (channels, [frames,] height, width); the batch size does not matter."""
+    return f"{model_hash}_{'x'.join(str(int(dim)) for dim in latent_shape[1:])}"
+
+
+def load_teacache_profile(profile_key, directory=None):
+    path = os.path.join(directory or TEACACHE_PROFILE_DIR, f"{profile_key}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_teacache_profile(profile, directory=None):
+    directory = directory or TEACACHE_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{profile['profile_key']}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def simulate_teacache_speed(raw_distances, coefficients, threshold):
+    """Speedup the skip rule in teacache_forward reaches on a recorded run.
+
+    `raw_distances` are the probe's rel-L1 changes of calls 1 .. n-1 of an unskipped run; as in the
+    forward, the first and last calls always compute.
+    """
+    num_calls = len(raw_distances) + 1
+    rescaled = np.polyval(coefficients, raw_distances)
+    computed, accumulated = 2, 0.0
+    for distance in rescaled[:-1]:
+        accumulated += distance
+        if accumulated >= threshold:
+            computed += 1
+            accumulated = 0.0
+    return num_calls / computed
+
+
+def fit_teacache_profile(raw_distances, output_distances, degree=4, max_threshold=1.0, threshold_step=0.01):
+    """Rescale coefficients mapping probe distance to output distance, and the measured speed table."""
+    raw_distances = np.asarray(raw_distances, dtype=np.float64)
+    output_distances = np.asarray(output_distances, dtype=np.float64)
+    if len(raw_distances) <= degree:
+        raise ValueError(f"Calibration needs at least {degree + 2} model calls, got {len(raw_distances) + 1}")
+    coefficients = np.polyfit(raw_distances, output_distances, degree)
+
+    # 每个速度只保留最先达到它的阈值，速度严格递增才能用于插值
+    speeds, thresholds = [1.0], [0.0]
+    for threshold in np.arange(threshold_step, max_threshold + threshold_step / 2, threshold_step):
+        speed = simulate_teacache_speed(raw_distances, coefficients, threshold)
+        if speed > speeds[-1] + 1e-6:
+            speeds.append(round(speed, 4))
+            thresholds.append(round(float(threshold), 4))
+    return coefficients.tolist(), speeds, thresholds
+
 
 class TeaCacheHunyuanVideoSampler:
+    MODEL_TYPE = "hunyuan_video"
+    CACHE_MODE = "output"
+
     @classmethod 
     def INPUT_TYPES(cls):
         return {
@@ -822,13 +2131,7 @@ class TeaCacheHunyuanVideoSampler:
                 "sampler": ("SAMPLER",),
                 "sigmas": ("SIGMAS",),
                 "latent_image": ("LATENT",),
-                "speedup": ([
-                    "Original (1x)", 
-                    "Fast (1.6x)", 
-                    "Faster (2.1x)",
-                    "Ultra Fast (3.2x)",
-                    "Shapeless Fast (4.4x)"
-                ], {
+                "speedup": (list(TEACACHE_PRESET_SPEEDS), {
                     "default": "Fast (1.6x)",
                     "tooltip": (
                         "Control TeaCache speed/quality trade-off:\n"
@@ -850,6 +2153,27 @@ class TeaCacheHunyuanVideoSampler:
                     "step": 0.1,
                     "label": "Custom Speed Multiplier"
                 })
+            },
+            "optional": {
+                "probe_stride": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 16,
+                    "step": 1,
+                    "tooltip": "Estimate the step change from every n-th image token; higher values lower the probe's cost and memory"
+                }),
+                "cache_mode": (["residual", "output"], {
+                    "default": cls.CACHE_MODE,
+                    "tooltip": "residual: skipped steps add the cached transformer-block residual to the current input and rerun the final layer; output: skipped steps return the previous model output"
+                }),
+                "calibrate": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Run every step in full, fit the rescale coefficients and speed table for this model and LoRA stack, and save them to ttp_toolset/teacache_profiles/ in the user directory for later runs"
+                }),
+                "lagged_decision": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Decide each skip from the previous step's distance, copied back without blocking, so the sampler never waits on the GPU. Every computed step moves one step later"
+                }),
             }
         }
 
@@ -858,194 +2182,209 @@ class TeaCacheHunyuanVideoSampler:
     FUNCTION = "sample"
     CATEGORY = "sampling/custom_sampling"
 
-    def calculate_threshold(self, speed_multiplier: float) -> float:
+    def calculate_threshold(self, speed_multiplier: float, adapter=None) -> float:
         """根据预设速度点进行线性插值，计算自定义速度对应的阈值"""
-        # 预设的速度倍数和对应阈值
-        predefined_speeds = [1.0, 1.6, 2.1, 3.2, 4.4]
-        predefined_thresholds = [0.0, 0.1, 0.15, 0.25, 0.35]
-        
-        # 使用 numpy 的线性插值函数
-        threshold = np.interp(speed_multiplier, predefined_speeds, predefined_thresholds)
-        
-        # 确保阈值不超过最大值
-        threshold = min(threshold, 0.35)
-        
-        return threshold
-
-    def teacache_forward(
-            self,
-            transformer,
-            x: torch.Tensor,
-            timestep: torch.Tensor,  # Should be in range(0, 1000).
-            context: Optional[torch.Tensor] = None,
-            y: Optional[torch.Tensor] = None,  # Text embedding for modulation.
-            guidance: Optional[torch.Tensor] = None,  # Guidance for modulation, should be cfg_scale x 1000.
-            attention_mask: Optional[torch.Tensor] = None,
-            control: Any = None,
-            transformer_options: Dict = {},
-            **kwargs
-        ) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
-        """TeaCache forward implementation"""
+        adapter = adapter or TEACACHE_ADAPTERS[self.MODEL_TYPE]
+        if speed_multiplier > adapter.speeds[-1]:
+            logger.info("TeaCache: %.2fx is beyond the %s speed table, using %.2fx", speed_multiplier, adapter.name, adapter.speeds[-1])
+        # 使用 numpy 的线性插值函数，超出范围时取端点阈值
+        return float(np.interp(speed_multiplier, adapter.speeds, adapter.thresholds))
+
+    def teacache_forward(self, transformer, adapter, *args, **kwargs) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
+        """TeaCache forward implementation; all arguments are passed through to the original forward"""
         should_calc = True
+        img = vec = None
+        
+        if transformer.cache_mode == "residual" and not adapter.residual_compatible(args, kwargs):
+            logger.warning("TeaCache: residual caching does not support these inputs (e.g. I2V guiding frames or reference latents), caching outputs")
+            transformer.cache_mode = "output"
         
         if transformer.enable_teacache:
             try:
-                # 获取输入维度
-                B, C, T, H, W = x.shape
-                
-                # 准备调制向量
-                try:
-                    # HunyuanVideo 使用 timestep_embedding 进行时间步编码
-                    time_emb = comfy.ldm.flux.layers.timestep_embedding(timestep, 256, time_factor=1.0).to(x.dtype)
-                    vec = transformer.time_in(time_emb)  # [B, hidden_size]
-                    
-                    # 文本调制 - HunyuanVideo 使用 vector_in 处理 y 而不是 context
-                    if y is not None:
-                        if not hasattr(transformer, 'params') or not hasattr(transformer.params, 'vec_in_dim'):
-                            raise AttributeError("Transformer missing required attributes: params.vec_in_dim")
-                        vec = vec + transformer.vector_in(y[:, :transformer.params.vec_in_dim])
-                    
-                    # 指导调制
-                    if guidance is not None and getattr(transformer, 'params', None) and transformer.params.guidance_embed:
-                        guidance_emb = comfy.ldm.flux.layers.timestep_embedding(guidance, 256).to(x.dtype)
-                        guidance_vec = transformer.guidance_in(guidance_emb)
-                        vec = vec + guidance_vec
-                        
-                except Exception as e:
-                    raise RuntimeError(f"Failed to prepare modulation vector: {str(e)}")
-                
-                # 嵌入图像
-                try:
-                    img = transformer.img_in(x)
-                except Exception as e:
-                    raise RuntimeError(f"Failed to embed image: {str(e)}")
+                # 探测：嵌入图像并计算第一个块的调制输入；嵌入结果留给随后的完整 forward 复用（见 sample 中对 embed_module 的替换）
+                img, vec, modulated_inp = adapter.probe(transformer, args, kwargs, transformer.probe_stride)
+                embed_input = adapter.embed_input(args, kwargs)
+                if embed_input is not None:
+                    # 完整 forward 中的块可能原地修改 img，残差的基准必须是独立的副本
+                    baseline = img.clone() if transformer.cache_mode == "residual" else None
+                    transformer.teacache_img_in = (embed_input, img, baseline)
                 
-                if transformer.enable_teacache:
+                # 计算相对 L1 距离并决定是否需要计算
+                if transformer.cnt == 0 or transformer.cnt == transformer.num_steps - 1:
+                    should_calc = True
+                    transformer.accumulated_rel_l1_distance = 0
+                    transformer.pending_decision = None
+                elif transformer.lagged_decision:
                     try:
-                        # 使用原地操作减少内存使用
-                        inp = img.clone()
-                        vec_ = vec.clone()
-                        
-                        # 获取调制参数
-                        modulation_output = transformer.double_blocks[0].img_mod(vec_)
-                        
-                        # 处理调制输出
-                        if isinstance(modulation_output, tuple):
-                            if len(modulation_output) >= 2:
-                                mod_shift = modulation_output[0]
-                                mod_scale = modulation_output[1]
-                                if hasattr(mod_shift, 'shift') and hasattr(mod_scale, 'scale'):
-                                    img_mod1_shift = mod_shift.shift
-                                    img_mod1_scale = mod_scale.scale
-                                else:
-                                    img_mod1_shift = mod_shift
-                                    img_mod1_scale = mod_scale
-                            else:
-                                raise ValueError(f"Tuple too short, expected at least 2 elements, got {len(modulation_output)}")
-                        elif hasattr(modulation_output, 'shift') and hasattr(modulation_output, 'scale'):
-                            img_mod1_shift = modulation_output.shift
-                            img_mod1_scale = modulation_output.scale
-                        elif hasattr(modulation_output, 'chunk'):
-                            chunks = modulation_output.chunk(6, dim=-1)
-                            img_mod1_shift = chunks[0]
-                            img_mod1_scale = chunks[1]
-                        else:
-                            raise ValueError(f"Unsupported modulation output format: {type(modulation_output)}")
-                        
-                        # 确保获取到的是张量
-                        if not isinstance(img_mod1_shift, torch.Tensor) or not isinstance(img_mod1_scale, torch.Tensor):
-                            raise ValueError(f"Failed to get tensor values for shift and scale")
-                        
-                        # 应用归一化和调制
-                        normed_inp = transformer.double_blocks[0].img_norm1(inp)
-                        del inp  # 释放内存
-                        
-                        modulated_inp = modulate(normed_inp, shift=img_mod1_shift, scale=img_mod1_scale)
-                        del normed_inp  # 释放内存
-                        
-                        # 计算相对 L1 距离并决定是否需要计算
-                        if transformer.cnt == 0 or transformer.cnt == transformer.num_steps - 1:
-                            should_calc = True
+                        should_calc = self.lagged_skip_decision(transformer, modulated_inp)
+                    except Exception as e:
+                        should_calc = True
+                else:
+                    try:
+                        # 每步读回一次距离（与设备同步一次），在主机端缩放和累加
+                        rel_l1 = relative_l1(modulated_inp, transformer.previous_modulated_input).cpu().item()
+                        transformer.accumulated_rel_l1_distance += transformer.teacache_rescale(rel_l1)
+                        should_calc = transformer.accumulated_rel_l1_distance >= transformer.rel_l1_thresh
+                        if should_calc:
                             transformer.accumulated_rel_l1_distance = 0
-                        else:
-                            try:
-                                coefficients = [7.33226126e+02, -4.01131952e+02, 6.75869174e+01, -3.14987800e+00, 9.61237896e-02]
-                                rescale_func = np.poly1d(coefficients)
-                                rel_l1 = ((modulated_inp - transformer.previous_modulated_input).abs().mean() / 
-                                         (transformer.previous_modulated_input.abs().mean() + 1e-6)).cpu().item()
-                                transformer.accumulated_rel_l1_distance += rescale_func(rel_l1)
-                                
-                                if transformer.accumulated_rel_l1_distance < transformer.rel_l1_thresh:
-                                    should_calc = False
-                                else:
-                                    should_calc = True
-                                    transformer.accumulated_rel_l1_distance = 0
-                            except Exception as e:
-                                should_calc = True
-                        
-                        transformer.previous_modulated_input = modulated_inp
-                        transformer.cnt += 1
-                        
                     except Exception as e:
                         should_calc = True
+                
+                transformer.previous_modulated_input = modulated_inp
+                transformer.cnt += 1
 
             except Exception as e:
                 should_calc = True
 
-        # 如果需要计算，调用原始的 forward 方法
+        # 还没有可复用的缓存时必须计算
+        cached = transformer.previous_residual if transformer.cache_mode == "residual" else transformer.previous_output
+        if cached is None or (transformer.cache_mode == "residual" and img is not None and cached.shape != img.shape):
+            should_calc = True
+
+        # 如果需要计算，调用原始的 forward 方法；残差由 sample 中挂在 final_layer 上的钩子记录
         if should_calc:
             try:
-                out = transformer.original_forward(x, timestep, context, y, guidance, 
-                                                attention_mask=attention_mask,
-                                                control=control,
-                                                transformer_options=transformer_options,
-                                                **kwargs)
-                transformer.previous_residual = out
+                transformer.previous_residual = None
+                out = transformer.original_forward(*args, **kwargs)
+                if transformer.cache_mode == "residual" and img is not None and transformer.previous_residual is None:
+                    logger.warning("TeaCache could not capture the transformer block residual, falling back to output caching")
+                    transformer.cache_mode = "output"
+                transformer.previous_output = out if transformer.cache_mode == "output" else None
                 return out
-            except Exception as e:
-                raise
+            finally:
+                transformer.teacache_img_in = None
+        else:
+            # 如果不需要计算：残差模式把缓存的残差加到本步的嵌入上，只运行 final_layer；输出模式返回之前的结果
+            transformer.teacache_img_in = None
+            if transformer.cache_mode == "residual":
+                out = transformer.teacache_final_layer(img + transformer.previous_residual, vec)
+                return adapter.unpatchify(transformer, out, adapter.forward_arg(args, kwargs, 0, "x").shape)
+            return transformer.previous_output
+
+    def lagged_skip_decision(self, transformer, modulated_inp):
+        """Decide this step from the previous step's distance, read back without waiting on the device.
+
+        Distance, rescaling, accumulation and reset run on the device exactly as in the synchronous
+        rule, so the computed steps are the synchronous rule's, each moved one step later.
+        """
+        # 先读上一步的结果：它的拷贝排在上一步的 forward 之前，此时通常早已完成，不会阻塞
+        should_calc = False
+        if transformer.pending_decision is not None:
+            decision, event = transformer.pending_decision
+            if event is not None:
+                event.synchronize()
+            should_calc = bool(decision)
+
+        if not isinstance(transformer.accumulated_rel_l1_distance, torch.Tensor):
+            transformer.accumulated_rel_l1_distance = torch.zeros((), dtype=transformer.accumulator_dtype, device=modulated_inp.device)
+        accumulated = transformer.accumulated_rel_l1_distance
+        rel_l1 = relative_l1(modulated_inp, transformer.previous_modulated_input)
+        accumulated += horner_poly(rel_l1.to(accumulated.dtype), transformer.teacache_coefficients)
+        decision = accumulated >= transformer.rel_l1_thresh
+        accumulated.masked_fill_(decision, 0)
+
+        # CUDA 上异步拷到锁页内存并记录事件，下一步再读；其他设备直接留着张量
+        if decision.is_cuda:
+            host = torch.empty((), dtype=torch.bool, pin_memory=True)
+            host.copy_(decision, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+            transformer.pending_decision = (host, event)
         else:
-            # 如果不需要计算，返回之前的结果
-            return transformer.previous_residual
+            transformer.pending_decision = (decision, None)
+        return should_calc
+
+    def calibration_forward(self, transformer, adapter, *args, **kwargs):
+        """Full forward on every call, recording the probe's raw rel-L1 change next to the output's"""
+        _, _, modulated_inp = adapter.probe(transformer, args, kwargs, transformer.probe_stride)
+        out = transformer.original_forward(*args, **kwargs)
+        previous_inp, previous_out = transformer.previous_modulated_input, transformer.previous_output
+        if previous_inp is not None and previous_inp.shape == modulated_inp.shape and previous_out.shape == out.shape:
+            # 留在设备上，采样结束后一次性读回
+            transformer.teacache_calibration.append(torch.stack([
+                relative_l1(modulated_inp, previous_inp).float(), relative_l1(out, previous_out).float()
+            ]))
+        transformer.previous_modulated_input = modulated_inp
+        transformer.previous_output = out
+        return out
+
+    def save_calibration(self, transformer, adapter, profile_key, latent_shape):
+        if not transformer.teacache_calibration:
+            raise ValueError("TeaCache calibration recorded no steps")
+        distances = torch.stack(transformer.teacache_calibration).cpu().numpy().astype(np.float64)
+        coefficients, speeds, thresholds = fit_teacache_profile(distances[:, 0], distances[:, 1])
+        profile = {
+            "model_type": adapter.name,
+            "profile_key": profile_key,
+            "coefficients": coefficients,
+            "speeds": speeds,
+            "thresholds": thresholds,
+            "calls": len(distances) + 1,
+            "latent_shape": list(latent_shape),
+            "raw_distances": distances[:, 0].tolist(),
+            "output_distances": distances[:, 1].tolist(),
+        }
+        path = save_teacache_profile(profile)
+        logger.info("TeaCache calibration for %s saved to %s, up to %.2fx", adapter.name, path, speeds[-1])
 
-    def sample(self, noise, guider, sampler, sigmas, latent_image, speedup, enable_custom_speed=False, custom_speed=1.0):
+    def sample(self, noise, guider, sampler, sigmas, latent_image, speedup, enable_custom_speed=False, custom_speed=1.0, probe_stride=1, cache_mode=None, calibrate=False, lagged_decision=False, model_type=None):
         """Sampling implementation"""
         device = comfy.model_management.get_torch_device()
+        cache_mode = cache_mode or self.CACHE_MODE
         
-        # 定义预设速度的阈值映射
-        predefined_speeds = [1.0, 1.6, 2.1, 3.2, 4.4]
-        predefined_thresholds = [0.0, 0.1, 0.15, 0.25, 0.35]
-        
-        # 根据是否启用自定义速度来决定使用哪个阈值
+        # 根据是否启用自定义速度来决定使用哪个速度倍数
         if enable_custom_speed:
             if not (1.0 <= custom_speed <= 4.4):
                 raise ValueError("Custom speed must be between 1.0 and 4.4")
-            threshold = self.calculate_threshold(custom_speed)
+            speed = custom_speed
         else:
-            # 定义预设的速度选项
-            thresh_map = {
-                "Original (1x)": 0.0,
-                "Fast (1.6x)": 0.1,
-                "Faster (2.1x)": 0.15,
-                "Ultra Fast (3.2x)": 0.25,
-                "Shapeless Fast (4.4x)": 0.35
-            }
-            if speedup not in thresh_map:
+            if speedup not in TEACACHE_PRESET_SPEEDS:
                 raise ValueError(f"Unsupported speedup option: {speedup}")
-            threshold = thresh_map[speedup]
+            speed = TEACACHE_PRESET_SPEEDS[speedup]
         
         try:
-            # 获取 transformer
+            # 获取 transformer 及其适配器
             transformer = guider.model_patcher.model.diffusion_model
+            adapter = get_teacache_adapter(transformer, model_type or self.MODEL_TYPE)
+            
+            # 按模型哈希加载校准结果（系数和速度表），校准模式下则重新测量
+            # 哈希失败（如 GGUF 等张量子类权重）时不使用配置，只有校准模式才需要报错
+            try:
+                profile_key = teacache_profile_key(model_patcher_hash(guider.model_patcher), latent_image["samples"].shape)
+            except Exception as e:
+                if calibrate:
+                    raise RuntimeError(f"TeaCache calibration could not identify the model: {e}")
+                logger.warning("TeaCache: could not hash the model (%s), calibration profiles are not used", e)
+                profile_key = None
+            profile = load_teacache_profile(profile_key) if profile_key and not calibrate else None
+            if profile is not None and profile.get("model_type") == adapter.name:
+                logger.info("TeaCache: using calibration profile %s", profile_key)
+                adapter = adapter.with_profile(profile)
+            threshold = self.calculate_threshold(speed, adapter)
+            if cache_mode == "residual" and not adapter.supports_residual:
+                logger.info("TeaCache: residual caching is not available for %s, caching outputs", adapter.name)
+                cache_mode = "output"
             
-            # 初始化 TeaCache 状态
-            transformer.enable_teacache = True
+            # 初始化 TeaCache 状态；阈值为 0 时不会跳过任何步，直接省掉探测
+            coefficients = adapter.coefficients or [1.0, 0.0]
+            transformer.enable_teacache = threshold > 0
             transformer.cnt = 0  
             transformer.num_steps = len(sigmas) - 1
             transformer.rel_l1_thresh = threshold
             transformer.accumulated_rel_l1_distance = 0
+            transformer.teacache_rescale = np.poly1d(coefficients)
+            transformer.teacache_coefficients = [float(c) for c in coefficients]
+            # 延后一步决定时累加器留在设备上；MPS 不支持 float64，退回 float32
+            transformer.lagged_decision = lagged_decision
+            transformer.accumulator_dtype = torch.float32 if device.type == "mps" else torch.float64
+            transformer.pending_decision = None
             transformer.previous_modulated_input = None
             transformer.previous_residual = None
+            transformer.previous_output = None
+            transformer.cache_mode = cache_mode
+            transformer.probe_stride = probe_stride
+            transformer.teacache_img_in = None
+            transformer.teacache_calibration = [] if calibrate else None
 
             latent = latent_image
             latent_image = latent["samples"].clone()
@@ -1058,10 +2397,34 @@ class TeaCacheHunyuanVideoSampler:
             # 保存原始 forward 方法
             transformer.original_forward = transformer.forward
             
-            # 使用 lambda 替换 forward 方法，确保正确绑定 self
-            transformer.forward = lambda x, t, context=None, y=None, guidance=None, attention_mask=None, control=None, transformer_options={}, **kwargs: self.teacache_forward(
-                transformer, x, t, context, y, guidance, attention_mask, control, transformer_options, **kwargs
-            )
+            # 完整 forward 对同一个输入调用嵌入层时直接返回探测阶段的结果
+            embed_module = adapter.embed_module(transformer) if not calibrate else None
+            if embed_module is not None:
+                original_embed = embed_module.forward
+                def cached_embed(inp):
+                    probe = transformer.teacache_img_in
+                    if probe is not None and probe[0] is inp:
+                        return probe[1]
+                    # 不是探测过的输入，残差不能再基于探测结果计算
+                    transformer.teacache_img_in = None
+                    return original_embed(inp)
+                embed_module.forward = cached_embed
+            
+            # final_layer 的输入减去嵌入层的输出即为所有 transformer 块的残差
+            final_layer = adapter.final_layer(transformer) if cache_mode == "residual" and not calibrate else None
+            if final_layer is not None:
+                transformer.teacache_final_layer = final_layer.forward
+                def capturing_final_layer(img, *args, **kwargs):
+                    probe = transformer.teacache_img_in
+                    baseline = probe[2] if probe is not None else None
+                    if transformer.cache_mode == "residual" and baseline is not None and img.shape == baseline.shape:
+                        transformer.previous_residual = img - baseline
+                    return transformer.teacache_final_layer(img, *args, **kwargs)
+                final_layer.forward = capturing_final_layer
+            
+            # 替换 forward 方法，所有参数原样传给 teacache_forward（校准时为 calibration_forward）
+            forward = self.calibration_forward if calibrate else self.teacache_forward
+            transformer.forward = lambda *args, **kwargs: forward(transformer, adapter, *args, **kwargs)
             
             try:
                 x0_output = {}
@@ -1079,12 +2442,24 @@ class TeaCacheHunyuanVideoSampler:
                     seed=noise.seed
                 )
                 samples = samples.to(comfy.model_management.intermediate_device())
+                if calibrate:
+                    self.save_calibration(transformer, adapter, profile_key, latent_image.shape)
                 
             finally:
                 # 恢复原始的 forward 方法
                 transformer.forward = transformer.original_forward
                 delattr(transformer, 'original_forward')
+                if embed_module is not None:
+                    del embed_module.forward
+                if final_layer is not None:
+                    del final_layer.forward
                 transformer.enable_teacache = False
+                transformer.teacache_img_in = None
+                transformer.previous_modulated_input = None
+                transformer.previous_residual = None
+                transformer.previous_output = None
+                transformer.teacache_calibration = None
+                transformer.pending_decision = None
 
             out = latent.copy()
             out["samples"] = samples
@@ -1099,30 +2474,63 @@ class TeaCacheHunyuanVideoSampler:
         except Exception as e:
             raise RuntimeError(f"Sampling failed: {str(e)}")
 
+
+class TTP_TeaCache_Sampler(TeaCacheHunyuanVideoSampler):
+    """TeaCache sampler for any architecture with an adapter in TEACACHE_ADAPTERS, picked from the model unless set."""
+    MODEL_TYPE = "auto"
+    CACHE_MODE = "residual"
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = super().INPUT_TYPES()
+        inputs["optional"]["model_type"] = (["auto", *TEACACHE_ADAPTERS], {
+            "default": "auto",
+            "tooltip": "Architecture adapter; auto picks it from the diffusion model class. Preset speeds are mapped onto each adapter's own speed table"
+        })
+        return inputs
+
 NODE_CLASS_MAPPINGS = {
     "TTPlanet_Tile_Preprocessor_Simple": TTPlanet_Tile_Preprocessor_Simple,
     "TTP_Image_Tile_Batch": TTP_Image_Tile_Batch,
     "TTP_Image_Assy": TTP_Image_Assy,
+    "TTP_Latent_Tile_Batch": TTP_Latent_Tile_Batch,
+    "TTP_Latent_Assy": TTP_Latent_Assy,
+    "TTP_Seam_Strips": TTP_Seam_Strips,
+    "TTP_Seam_Composite": TTP_Seam_Composite,
+    "TTP_Tile_Select": TTP_Tile_Select,
+    "TTP_Tile_Cache_Lookup": TTP_Tile_Cache_Lookup,
+    "TTP_Tile_Cache_Store": TTP_Tile_Cache_Store,
     "TTP_CoordinateSplitter": TTP_CoordinateSplitter,
     "TTP_condtobatch": TTP_condtobatch,
     "TTP_condsetarea_merge": TTP_condsetarea_merge,
     "TTP_Tile_image_size": Tile_imageSize,
     "TTP_condsetarea_merge_test": TTP_condsetarea_merge_test,
+    "TTP_Regional_Prompt_Batch": TTP_Regional_Prompt_Batch,
     "TTP_Expand_And_Mask": TTP_Expand_And_Mask,
     "TTP_text_mix": TTP_text_mix,
-    "TeaCacheHunyuanVideoSampler": TeaCacheHunyuanVideoSampler
+    "TeaCacheHunyuanVideoSampler": TeaCacheHunyuanVideoSampler,
+    "TTP_TeaCache_Sampler": TTP_TeaCache_Sampler
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "TTPlanet_Tile_Preprocessor_Simple": "TTP Tile Preprocessor Simple",
     "TTP_Image_Tile_Batch": "TTP_Image_Tile_Batch",
     "TTP_Image_Assy": "TTP_Image_Assy",
+    "TTP_Latent_Tile_Batch": "TTP_Latent_Tile_Batch",
+    "TTP_Latent_Assy": "TTP_Latent_Assy",
+    "TTP_Seam_Strips": "TTP_Seam_Strips",
+    "TTP_Seam_Composite": "TTP_Seam_Composite",
+    "TTP_Tile_Select": "TTP_Tile_Select",
+    "TTP_Tile_Cache_Lookup": "TTP_Tile_Cache_Lookup",
+    "TTP_Tile_Cache_Store": "TTP_Tile_Cache_Store",
     "TTP_CoordinateSplitter": "TTP_CoordinateSplitter",
     "TTP_condtobatch": "TTP_cond to batch",
     "TTP_condsetarea_merge": "TTP_condsetarea_merge",
     "TTP_Tile_image_size": "TTP_Tile_image_size",
     "TTP_condsetarea_merge_test": "TTP_condsetarea_merge_test",
+    "TTP_Regional_Prompt_Batch": "TTP_Regional_Prompt_Batch",
     "TTP_Expand_And_Mask": "TTP_Expand_And_Mask",
     "TTP_text_mix": "TTP_text_mix",
-    "TeaCacheHunyuanVideoSampler": "TTP_TeaCache HunyuanVideo Sampler"
+    "TeaCacheHunyuanVideoSampler": "TTP_TeaCache HunyuanVideo Sampler",
+    "TTP_TeaCache_Sampler": "TTP_TeaCache Sampler"
 }
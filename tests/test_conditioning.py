@@ -0,0 +1,85 @@
+"""Conditioning area tests. CPU only; run from a ComfyUI checkout so the comfy modules import."""
+import os
+import sys
+
+import pytest
+import torch
+
+pytest.importorskip("comfy.model_management")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TTP_toolsets as ttp  # noqa: E402
+
+
+def tile_boxes(width, height, tile_size):
+    """(x, y, width, height) boxes of the fixed tile grid TTP_Image_Tile_Batch cuts."""
+    return [(x, y, tile_size, tile_size)
+            for y in ttp.fixed_tile_starts(height, tile_size)
+            for x in ttp.fixed_tile_starts(width, tile_size)]
+
+
+def baseline_areas(boxes):
+    """Areas as TTP_condsetarea_merge computed them per entry before latent_areas."""
+    return [(h // 8, w // 8, y // 8, x // 8) for x, y, w, h in boxes]
+
+
+@pytest.mark.parametrize("width, height, tile_size", [(1500, 2100, 1024), (2048, 2048, 1024), (1000, 1333, 512)])
+def test_default_areas_match_baseline(width, height, tile_size):
+    boxes = tile_boxes(width, height, tile_size)
+    areas = ttp.latent_areas(boxes)
+    assert areas == baseline_areas(boxes)
+    # Equal tiles keep one area size, so ComfyUI can batch the area conds into one forward
+    assert len({area[:2] for area in areas}) == 1
+
+
+def test_merge_node_areas_match_baseline():
+    boxes = tile_boxes(1500, 2100, 1024)
+    conds = [[torch.randn(1, 4, 8), {"pooled_output": torch.randn(1, 8)}] for _ in boxes]
+    merged, = ttp.TTP_condsetarea_merge().apply_coordinates_to_batch(conds, boxes, 1.0)
+    assert [cond[1]["area"] for cond in merged] == baseline_areas(boxes)
+    assert all(cond[0] is source[0] for cond, source in zip(merged, conds))
+
+
+def test_video_areas_span_every_latent_frame():
+    areas = ttp.latent_areas([(0, 0, 512, 256), (256, 0, 512, 256)], frames=33)
+    assert areas == [(9, 32, 64, 0, 0, 0), (9, 32, 64, 0, 0, 32)]
+
+
+def shared_prompt(count, **options):
+    context, pooled = torch.randn(1, 4, 8), torch.randn(1, 8)
+    return [[context, {"pooled_output": pooled, **options}] for _ in range(count)]
+
+
+def test_dedupe_merges_adjacent_tiles_into_one_mask():
+    boxes = tile_boxes(1500, 2100, 1024)
+    areas = ttp.latent_areas(boxes)
+    merged = ttp.dedupe_conditioning_areas(shared_prompt(len(boxes)), areas, 1.0, ttp.latent_canvas_size(boxes))
+    assert len(merged) == 1
+    mask = merged[0][1]["mask"]
+    assert mask.shape == (1, 2100 // 8, 1500 // 8)
+    assert bool(mask.all())
+    assert "area" not in merged[0][1]
+
+
+def test_dedupe_keeps_entries_with_different_options_apart():
+    boxes = tile_boxes(1500, 2100, 1024)
+    control_a, control_b = object(), object()
+    conds = shared_prompt(len(boxes), control=control_a)
+    conds[1][1] = {**conds[1][1], "control": control_b}
+    merged = ttp.dedupe_conditioning_areas(conds, ttp.latent_areas(boxes), 1.0, ttp.latent_canvas_size(boxes))
+    controls = [cond[1]["control"] for cond in merged]
+    assert controls.count(control_b) == 1 and control_a in controls
+    assert sum("mask" in cond[1] for cond in merged) == 1
+
+
+def test_dedupe_leaves_far_apart_tiles_and_own_masks_alone():
+    boxes = tile_boxes(3000, 3000, 1024)
+    areas = ttp.latent_areas(boxes)
+    corners = [0, len(boxes) - 1]
+    # Two opposite corners of a 3x3 grid: their bounds cover the whole latent, far more than the two tiles
+    merged = ttp.dedupe_conditioning_areas(shared_prompt(2), [areas[i] for i in corners], 1.0, ttp.latent_canvas_size(boxes))
+    assert [cond[1]["area"] for cond in merged] == [areas[i] for i in corners]
+
+    own_mask = torch.ones((1, 375, 375))
+    merged = ttp.dedupe_conditioning_areas(shared_prompt(2, mask=own_mask), areas[:2], 1.0, ttp.latent_canvas_size(boxes))
+    assert len(merged) == 2 and all(cond[1]["mask"] is own_mask for cond in merged)
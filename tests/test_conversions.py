@@ -0,0 +1,78 @@
+"""Tensor/PIL/NumPy conversion tests. CPU only; run from a ComfyUI checkout so the comfy modules import."""
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+pytest.importorskip("comfy.model_management")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TTP_toolsets as ttp  # noqa: E402
+
+
+def baseline_pil2tensor(image):
+    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+
+
+def baseline_tensor2pil(t_image):
+    return Image.fromarray(np.clip(255.0 * t_image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
+
+
+def random_image(height=64, width=96, seed=0):
+    # Values outside 0..1 check the clamping as well
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand((1, height, width, 3), generator=generator) * 1.2 - 0.1
+
+
+def test_conversions_match_baseline():
+    image = random_image()
+    pil = ttp.tensor2pil(image)
+    assert np.array_equal(np.array(pil), np.array(baseline_tensor2pil(image)))
+    assert torch.equal(ttp.pil2tensor(pil), baseline_pil2tensor(pil))
+    assert np.array_equal(ttp.tensor2np(image[0]), np.array(pil))
+
+
+def test_numpy_round_trip():
+    image = random_image().clamp(0, 1)
+    assert torch.equal(ttp.np2tensor(ttp.tensor2np(image[0])), ttp.pil2tensor(ttp.tensor2pil(image)))
+    # keep_float shares the float32 tensor's memory and round-trips exactly
+    array = ttp.tensor2np(image[0], keep_float=True)
+    assert np.shares_memory(array, image.numpy())
+    assert torch.equal(ttp.np2tensor(array), image)
+
+
+def peak_scratch_bytes(fn, *args):
+    """Peak bytes allocated while fn runs: NumPy arrays and Python bytes via tracemalloc, torch buffers via the profiler.
+
+    Both peaks are added, which is exact when both kinds of buffer are alive at once and an upper
+    bound otherwise. PIL's own image storage is not counted by either.
+    """
+    from torch.profiler import ProfilerActivity, profile
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True):
+        fn(*args)  # warm up, so one-off allocations of the first call are not counted
+    tracemalloc.start()
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn(*args)
+    _, numpy_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    current = torch_peak = 0
+    for event in sorted(prof.events(), key=lambda event: event.time_range.start):
+        if event.cpu_parent is None:
+            current += event.cpu_memory_usage
+            torch_peak = max(torch_peak, current)
+    return numpy_peak + torch_peak
+
+
+if __name__ == "__main__":
+    for name, (width, height) in {"1080p": (1920, 1080), "4K": (3840, 2160)}.items():
+        image = torch.rand((1, height, width, 3))
+        pil = ttp.tensor2pil(image)
+        for label, old, new, arg in (("pil2tensor", baseline_pil2tensor, ttp.pil2tensor, pil), ("tensor2pil", baseline_tensor2pil, ttp.tensor2pil, image)):
+            before, after = peak_scratch_bytes(old, arg), peak_scratch_bytes(new, arg)
+            print(f"{name} {label}: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB")
+        print(f"{name} tensor2np: {peak_scratch_bytes(ttp.tensor2np, image[0]) / 2**20:.1f} MB, "
+              f"keep_float {peak_scratch_bytes(ttp.tensor2np, image[0], True) / 2**20:.1f} MB")
@@ -0,0 +1,97 @@
+"""TTP_Expand_And_Mask tests. CPU only; run from a ComfyUI checkout so the comfy modules import."""
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+pytest.importorskip("comfy.model_management")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TTP_toolsets as ttp  # noqa: E402
+
+DIRECTIONS = ["left", "right", "top", "bottom"]
+
+
+def baseline_expand_and_mask(image, fill_mode="duplicate", fill_alpha_decision=False, fill_color="#7F7F7F", **kwargs):
+    """The node as it was before vectorisation: PIL pastes per block, the mask filled block by block."""
+    pil_image = ttp.tensor2pil(image)
+    orig_width, orig_height = pil_image.size
+    has_alpha = pil_image.mode == "RGBA"
+    expand = {dir: kwargs.get(f"expand_{dir}", False) for dir in DIRECTIONS}
+    blocks = {dir: kwargs.get(f"num_blocks_{dir}", 0) if expand[dir] else 0 for dir in DIRECTIONS}
+    total_width = orig_width * (1 + blocks["left"] + blocks["right"])
+    total_height = orig_height * (1 + blocks["top"] + blocks["bottom"])
+
+    expanded = Image.new(pil_image.mode, (total_width, total_height))
+    if fill_mode == "white":
+        fill = Image.new(pil_image.mode, (orig_width, orig_height), color=(255,) * len(pil_image.mode))
+    else:
+        fill = pil_image.copy()
+    left_offset, top_offset = orig_width * blocks["left"], orig_height * blocks["top"]
+    expanded.paste(pil_image, (left_offset, top_offset))
+
+    # Side blocks, then corner blocks where two expanded sides meet
+    steps = {"left": (-1, 0), "right": (1, 0), "top": (0, -1), "bottom": (0, 1)}
+    filled = []
+    for dir, (dx, dy) in steps.items():
+        for i in range(1, blocks[dir] + 1):
+            filled.append((left_offset + dx * orig_width * i, top_offset + dy * orig_height * i))
+    for horizontal in ("left", "right"):
+        for vertical in ("top", "bottom"):
+            if expand[horizontal] and expand[vertical]:
+                for i in range(1, blocks[horizontal] + 1):
+                    for j in range(1, blocks[vertical] + 1):
+                        filled.append((left_offset + steps[horizontal][0] * orig_width * i, top_offset + steps[vertical][1] * orig_height * j))
+    for pos in filled:
+        expanded.paste(fill, pos)
+
+    mask = np.zeros((total_height, total_width), dtype=np.float32)
+    if has_alpha:
+        alpha = np.array(pil_image.getchannel("A"), dtype=np.float32) / 255.0
+        mask[top_offset:top_offset + orig_height, left_offset:left_offset + orig_width] = 1.0 - alpha
+    for x, y in filled:
+        mask[y:y + orig_height, x:x + orig_width] = 1.0
+
+    if fill_alpha_decision and has_alpha:
+        background = Image.new("RGBA", expanded.size, ttp.TTP_Expand_And_Mask().hex_to_rgba(fill_color))
+        expanded = Image.alpha_composite(background, expanded.convert("RGBA")).convert("RGB")
+    return ttp.pil2tensor(expanded), torch.from_numpy(mask)[None, None]
+
+
+def quantised_image(channels, height=40, width=56, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randint(0, 256, (1, height, width, channels), generator=generator).float() / 255
+
+
+def expand_options(blocks):
+    options = {f"expand_{dir}": dir in blocks for dir in DIRECTIONS}
+    options.update({f"num_blocks_{dir}": blocks.get(dir, 1) for dir in DIRECTIONS})
+    return options
+
+
+@pytest.mark.parametrize("blocks", [{"left": 1}, {"right": 2, "bottom": 1}, {"left": 1, "top": 3}, {"left": 2, "right": 1, "top": 1, "bottom": 2}])
+@pytest.mark.parametrize("fill_mode", ["duplicate", "white"])
+@pytest.mark.parametrize("channels", [3, 4])
+def test_block_expansion_matches_baseline(channels, fill_mode, blocks):
+    image = quantised_image(channels)
+    options = expand_options(blocks)
+    expanded, mask = ttp.TTP_Expand_And_Mask().expand_and_mask(image, fill_mode, **options)
+    expected_image, expected_mask = baseline_expand_and_mask(image, fill_mode, **options)
+    assert expanded.shape == expected_image.shape
+    assert (expanded - expected_image).abs().max() <= 1e-6
+    assert (mask - expected_mask[0]).abs().max() <= 1e-6
+
+
+@pytest.mark.parametrize("fill_color", ["#7F7F7F", "#20406080"])
+def test_alpha_fill_matches_baseline(fill_color):
+    image = quantised_image(4)
+    options = expand_options({"right": 1, "top": 1})
+    expanded, mask = ttp.TTP_Expand_And_Mask().expand_and_mask(image, "duplicate", True, fill_color, **options)
+    expected_image, expected_mask = baseline_expand_and_mask(image, "duplicate", True, fill_color, **options)
+    assert expanded.shape == expected_image.shape
+    # PIL composites in 8 bits, the node in float
+    assert (expanded - expected_image).abs().max() <= 1 / 255 + 1e-6
+    assert (mask - expected_mask[0]).abs().max() <= 1e-6
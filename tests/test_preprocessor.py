@@ -0,0 +1,96 @@
+"""Tile preprocessor tests. CPU only; run from a ComfyUI checkout so the comfy modules import."""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+pytest.importorskip("comfy.model_management")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TTP_toolsets as ttp  # noqa: E402
+
+
+def smooth_frames(num_frames, height, width, seed=0):
+    """Random frames with some spatial structure, closer to photos than white noise."""
+    generator = torch.Generator().manual_seed(seed)
+    frames = torch.rand((num_frames, 3, height, width), generator=generator)
+    return F.avg_pool2d(frames, 5, 1, 2).movedim(1, -1).contiguous()
+
+
+@pytest.mark.parametrize("scale_factor", [1.05, 1.5, 2.0, 3.35])
+@pytest.mark.parametrize("size", [(120, 200), (97, 151)])
+def test_area_resize_matches_cv2(scale_factor, size):
+    frame = smooth_frames(1, *size)[0].numpy()
+    new_size = (int(size[0] / scale_factor), int(size[1] / scale_factor))
+    expected = cv2.resize(frame, new_size[::-1], interpolation=cv2.INTER_AREA)
+    result = ttp.resize_area_torch(torch.from_numpy(frame).movedim(-1, 0)[None], new_size)[0].movedim(0, -1)
+    assert np.abs(result.numpy() - expected).max() < 1e-4
+
+
+@pytest.mark.parametrize("scale_factor", [1.05, 1.5, 2.0])
+def test_torch_backend_matches_cv2(scale_factor):
+    node = ttp.TTPlanet_Tile_Preprocessor_Simple()
+    image = smooth_frames(2, 150, 226)
+    torch_result, = node.process_image(image, scale_factor, 3.0, backend="torch")
+    float_result, = node.process_image(image, scale_factor, 3.0, backend="cv2", keep_float=True)
+    uint8_result, = node.process_image(image, scale_factor, 3.0, backend="cv2")
+    assert torch_result.shape == uint8_result.shape
+    assert (torch_result - float_result).abs().max() * 255 < 0.05
+    # The default cv2 path rounds to 8 bits after every stage
+    assert (torch_result - uint8_result).abs().max() * 255 < 2.5
+
+
+def test_thread_pool_matches_serial_and_restores_cv2_threads():
+    node = ttp.TTPlanet_Tile_Preprocessor_Simple()
+    image = smooth_frames(6, 64, 96)
+    threads = cv2.getNumThreads()
+    serial, = node.process_image(image, 1.5, 3.0, cv2_workers=1)
+    parallel, = node.process_image(image, 1.5, 3.0, cv2_workers=3)
+    assert torch.equal(serial, parallel)
+    assert cv2.getNumThreads() == threads
+
+
+def benchmark(fn, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_frame_pool(num_frames=240, height=480, width=640):
+    """Seconds for the cv2 backend over a video, serial against the frame pool, with OpenCV's own threads on and off."""
+    node = ttp.TTPlanet_Tile_Preprocessor_Simple()
+    image = smooth_frames(num_frames, height, width)
+    cores = os.cpu_count() or 1
+    threads = cv2.getNumThreads()
+    results = {}
+    for cv2_threads in (threads, 1):
+        cv2.setNumThreads(cv2_threads)
+        label = f"serial, OpenCV {cv2_threads} thread(s)"
+        results[label] = benchmark(lambda: node.process_image(image, 2.0, 3.0, cv2_workers=1), repeats=1)
+    cv2.setNumThreads(threads)
+    for workers in sorted({cores, 2 * cores}):
+        results[f"pool of {workers}"] = benchmark(lambda: node.process_image(image, 2.0, 3.0, cv2_workers=workers), repeats=1)
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{os.cpu_count()} CPU core(s), OpenCV uses {cv2.getNumThreads()} thread(s)")
+    for label, seconds in benchmark_frame_pool().items():
+        print(f"240 x 480x640 frames, {label}: {seconds:.2f} s")
+
+    node = ttp.TTPlanet_Tile_Preprocessor_Simple()
+    image = smooth_frames(16, 1000, 1500)
+    for scale_factor in (1.5, 2.0):
+        cv2_time = benchmark(lambda: node.process_image(image, scale_factor, 3.0, backend="cv2"))
+        torch_time = benchmark(lambda: node.process_image(image, scale_factor, 3.0, backend="torch"))
+        print(f"16 x 1000x1500 at {scale_factor}x: cv2 {cv2_time:.2f} s, torch ({ttp.comfy.model_management.get_torch_device()}) {torch_time:.2f} s")
@@ -0,0 +1,352 @@
+"""TeaCache skip-rule tests. CPU only; run from a ComfyUI checkout so the comfy modules import."""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from typing import NamedTuple
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+pytest.importorskip("comfy.model_management")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TTP_toolsets as ttp  # noqa: E402
+from comfy.ldm.flux.layers import timestep_embedding  # noqa: E402
+
+COEFFICIENTS = ttp.HunyuanVideoTeaCacheAdapter.coefficients
+
+
+def modulated_inputs(num_calls, dtype, seed=0, shape=(1, 256, 64)):
+    """A denoising-like sequence: large changes early, small ones late."""
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(shape, generator=generator)
+    inputs = []
+    for step in range(num_calls):
+        x = x + torch.randn(shape, generator=generator) * 0.3 * (1 - step / num_calls) ** 2
+        inputs.append(x.to(dtype))
+    return inputs
+
+
+def item_baseline_schedule(inputs, coefficients, threshold):
+    """The original skip rule, written out: .cpu().item() and np.poly1d per step."""
+    rescale_func = np.poly1d(coefficients)
+    accumulated, previous, schedule = 0, None, []
+    for cnt, inp in enumerate(inputs):
+        if cnt == 0 or cnt == len(inputs) - 1:
+            should_calc = True
+            accumulated = 0
+        else:
+            rel_l1 = ((inp - previous).abs().mean() / (previous.abs().mean() + 1e-6)).cpu().item()
+            accumulated += rescale_func(rel_l1)
+            if accumulated < threshold:
+                should_calc = False
+            else:
+                should_calc = True
+                accumulated = 0
+        previous = inp
+        schedule.append(should_calc)
+    return schedule
+
+
+class SequenceAdapter(ttp.HunyuanVideoTeaCacheAdapter):
+    """Feeds a fixed sequence of modulated inputs to teacache_forward in place of a real model probe."""
+
+    def __init__(self, inputs):
+        self.inputs = iter(inputs)
+
+    def embed_input(self, args, kwargs):
+        return None
+
+    def probe(self, transformer, args, kwargs, stride=1):
+        return None, None, next(self.inputs)
+
+
+def teacache_schedule(inputs, coefficients, threshold, lagged_decision=False, accumulator_dtype=torch.float64):
+    computed = []
+    transformer = SimpleNamespace(
+        enable_teacache=True, cnt=0, num_steps=len(inputs), rel_l1_thresh=threshold,
+        accumulated_rel_l1_distance=0, teacache_rescale=np.poly1d(coefficients),
+        teacache_coefficients=list(coefficients), lagged_decision=lagged_decision,
+        accumulator_dtype=accumulator_dtype, pending_decision=None,
+        previous_modulated_input=None, previous_residual=None, previous_output=None,
+        cache_mode="output", probe_stride=1, teacache_img_in=None,
+        original_forward=lambda x: computed.append(True) or x,
+    )
+    sampler = ttp.TeaCacheHunyuanVideoSampler()
+    adapter = SequenceAdapter(inputs)
+    schedule = []
+    for _ in inputs:
+        before = len(computed)
+        sampler.teacache_forward(transformer, adapter, torch.zeros(1))
+        schedule.append(len(computed) > before)
+    return schedule
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+@pytest.mark.parametrize("threshold", [0.1, 0.15, 0.25, 0.35])
+def test_skip_schedule_matches_item_baseline(dtype, threshold):
+    inputs = modulated_inputs(50, dtype)
+    expected = item_baseline_schedule(inputs, COEFFICIENTS, threshold)
+    assert teacache_schedule(inputs, COEFFICIENTS, threshold) == expected
+    # The schedule has to actually skip something for the comparison to mean anything
+    assert not all(expected)
+
+
+@pytest.mark.parametrize("accumulator_dtype", [torch.float32, torch.float64])
+@pytest.mark.parametrize("threshold", [0.1, 0.15, 0.25, 0.35])
+def test_lagged_schedule_moves_each_computed_step_one_later(accumulator_dtype, threshold):
+    inputs = modulated_inputs(50, torch.float32)
+    baseline = item_baseline_schedule(inputs, COEFFICIENTS, threshold)
+    # First and last steps are always computed; every other step the baseline computes happens one step later
+    last = len(inputs) - 1
+    expected = [t in (0, last) or (t > 1 and baseline[t - 1]) for t in range(len(inputs))]
+    lagged = teacache_schedule(inputs, COEFFICIENTS, threshold, lagged_decision=True, accumulator_dtype=accumulator_dtype)
+    assert lagged == expected
+    assert sum(lagged) <= sum(baseline)
+
+
+class ModulationOut(NamedTuple):
+    shift: torch.Tensor
+    scale: torch.Tensor
+    gate: torch.Tensor
+
+
+class MockModulation(nn.Module):
+    def __init__(self, dim):
+        super().__init__()
+        self.lin = nn.Linear(dim, 6 * dim)
+
+    def forward(self, vec):
+        chunks = self.lin(F.silu(vec))[:, None].chunk(6, dim=-1)
+        return ModulationOut(*chunks[:3]), ModulationOut(*chunks[3:])
+
+
+class MockDoubleBlock(nn.Module):
+    """Updates img in place, as ComfyUI's DiT blocks may."""
+
+    def __init__(self, dim):
+        super().__init__()
+        self.img_mod = MockModulation(dim)
+        self.img_norm1 = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
+        self.mlp = nn.Sequential(nn.Linear(dim, 2 * dim), nn.GELU(), nn.Linear(2 * dim, dim))
+
+    def forward(self, img, vec):
+        mod, _ = self.img_mod(vec)
+        img += mod.gate * self.mlp(self.img_norm1(img) * (1 + mod.scale) + mod.shift)
+        return img
+
+
+class MockFinalLayer(nn.Module):
+    def __init__(self, dim, out_dim):
+        super().__init__()
+        self.norm_final = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
+        self.adaLN_modulation = nn.Linear(dim, 2 * dim)
+        self.linear = nn.Linear(dim, out_dim)
+
+    def forward(self, x, vec, modulation_dims=None):
+        shift, scale = self.adaLN_modulation(F.silu(vec))[:, None].chunk(2, dim=-1)
+        return self.linear(self.norm_final(x) * (1 + scale) + shift)
+
+
+class MockPatchEmbed(nn.Module):
+    def __init__(self, channels, dim, patch_size):
+        super().__init__()
+        self.proj = nn.Conv3d(channels, dim, kernel_size=patch_size, stride=patch_size)
+
+    def forward(self, x):
+        return self.proj(x).flatten(2).transpose(1, 2)
+
+
+class HunyuanVideo(nn.Module):
+    """A small model with HunyuanVideo's attribute layout and forward_orig data flow."""
+
+    def __init__(self, channels=4, dim=64, depth=4, patch_size=(1, 2, 2), vec_in_dim=16):
+        super().__init__()
+        self.patch_size = list(patch_size)
+        self.out_channels = channels
+        self.params = SimpleNamespace(vec_in_dim=vec_in_dim, guidance_embed=False)
+        self.img_in = MockPatchEmbed(channels, dim, patch_size)
+        self.time_in = nn.Sequential(nn.Linear(256, dim), nn.SiLU(), nn.Linear(dim, dim))
+        self.vector_in = nn.Linear(vec_in_dim, dim)
+        self.double_blocks = nn.ModuleList(MockDoubleBlock(dim) for _ in range(depth))
+        self.final_layer = MockFinalLayer(dim, channels * int(np.prod(patch_size)))
+        self.full_forwards = 0
+
+    def forward(self, x, timestep, context, y, guidance=None, attention_mask=None, control=None, transformer_options={}, **kwargs):
+        self.full_forwards += 1
+        initial_shape = list(x.shape)
+        img = self.img_in(x)
+        vec = self.time_in(timestep_embedding(timestep, 256, time_factor=1.0).to(img.dtype))
+        vec = vec + self.vector_in(y[:, :self.params.vec_in_dim])
+        for block in self.double_blocks:
+            img = block(img, vec)
+        img = self.final_layer(img, vec)
+        shape = [initial_shape[2 + i] // self.patch_size[i] for i in range(3)]
+        img = img.reshape([img.shape[0]] + shape + [self.out_channels] + self.patch_size)
+        img = img.permute(0, 4, 1, 5, 2, 6, 3, 7)
+        return img.reshape(initial_shape[0], self.out_channels, *initial_shape[2:])
+
+
+class MockBaseModel(nn.Module):
+    def __init__(self, diffusion_model):
+        super().__init__()
+        self.diffusion_model = diffusion_model
+
+    def process_latent_out(self, latent):
+        return latent
+
+
+class MockGuider:
+    """Euler sampling of a rectified flow; `calls` optionally replaces the loop with explicit (x, sigma, kwargs) calls."""
+
+    def __init__(self, model, calls=None):
+        self.model_patcher = SimpleNamespace(model=MockBaseModel(model), patches={}, backup={})
+        self.calls = calls
+        self.outputs = []
+        generator = torch.Generator().manual_seed(1)
+        self.y = torch.randn(1, model.params.vec_in_dim, generator=generator)
+
+    def sample(self, noise, latent_image, sampler, sigmas, denoise_mask=None, callback=None, disable_pbar=False, seed=None):
+        model = self.model_patcher.model.diffusion_model
+        with torch.no_grad():
+            if self.calls is not None:
+                for x, sigma, kwargs in self.calls:
+                    self.outputs.append(model(x, sigma * 1000, None, self.y, **kwargs))
+                return self.outputs[-1]
+            x = noise * sigmas[0]
+            for i in range(len(sigmas) - 1):
+                velocity = model(x, sigmas[i:i + 1] * 1000, None, self.y)
+                x = x + (sigmas[i + 1] - sigmas[i]) * velocity
+            return x
+
+
+def mock_noise(shape):
+    generator = torch.Generator().manual_seed(0)
+    return SimpleNamespace(seed=0, generate_noise=lambda latent: torch.randn(shape, generator=generator))
+
+
+@pytest.fixture
+def mock_env(monkeypatch, tmp_path):
+    monkeypatch.setattr(ttp.latent_preview, "prepare_callback", lambda *args, **kwargs: None)
+    monkeypatch.setattr(ttp, "TEACACHE_PROFILE_DIR", str(tmp_path))
+    torch.manual_seed(0)
+    return HunyuanVideo()
+
+
+def run_sampler(model, guider, speedup="Fast (1.6x)", cache_mode="output", steps=30, shape=(1, 4, 3, 16, 16)):
+    sigmas = torch.linspace(1.0, 0.0, steps + 1)
+    latent = {"samples": torch.zeros(shape)}
+    sampler = ttp.TeaCacheHunyuanVideoSampler()
+    out, _ = sampler.sample(mock_noise(shape), guider, None, sigmas, latent, speedup, cache_mode=cache_mode)
+    return out["samples"]
+
+
+def test_residual_skip_reproduces_unchanged_step(mock_env):
+    """With in-place blocks, a skipped step on an unchanged input must rebuild the computed output exactly."""
+    x = torch.randn(1, 4, 3, 16, 16)
+    sigma = torch.tensor([0.5])
+    guider = MockGuider(mock_env, calls=[(x, sigma, {}), (x, sigma, {})])
+    run_sampler(mock_env, guider, "Shapeless Fast (4.4x)", cache_mode="residual", steps=10)
+    assert mock_env.full_forwards == 1
+    torch.testing.assert_close(guider.outputs[1], guider.outputs[0], rtol=1e-5, atol=1e-5)
+
+
+def test_residual_falls_back_for_guiding_frames(mock_env, caplog):
+    x = torch.randn(1, 4, 3, 16, 16)
+    sigma = torch.tensor([0.5])
+    kwargs = {"guiding_frame_index": 0}
+    guider = MockGuider(mock_env, calls=[(x, sigma, kwargs), (x, sigma, kwargs)])
+    run_sampler(mock_env, guider, "Shapeless Fast (4.4x)", cache_mode="residual", steps=10)
+    assert "caching outputs" in caplog.text
+    torch.testing.assert_close(guider.outputs[1], guider.outputs[0])
+
+
+def test_calibration_profile_is_keyed_by_model_and_latent_size(mock_env, tmp_path):
+    shape = (1, 4, 3, 16, 16)
+    sigmas = torch.linspace(1.0, 0.0, 21)
+    sampler = ttp.TeaCacheHunyuanVideoSampler()
+    guider = MockGuider(mock_env)
+    sampler.sample(mock_noise(shape), guider, None, sigmas, {"samples": torch.zeros(shape)}, "Fast (1.6x)", calibrate=True)
+
+    key = ttp.teacache_profile_key(ttp.model_patcher_hash(guider.model_patcher), shape)
+    assert key.endswith("_4x3x16x16")
+    profile = ttp.load_teacache_profile(key)
+    assert profile["model_type"] == "hunyuan_video" and len(profile["coefficients"]) == 5
+    assert profile["speeds"][0] == 1.0 and profile["speeds"] == sorted(profile["speeds"])
+    assert ttp.load_teacache_profile(ttp.teacache_profile_key(ttp.model_patcher_hash(guider.model_patcher), (1, 4, 3, 32, 32))) is None
+
+
+def test_model_hash_tells_patches_on_the_same_keys_apart(mock_env):
+    guider = MockGuider(mock_env)
+    key = "diffusion_model.final_layer.linear.weight"
+    hashes = []
+    for seed in (0, 1):
+        lora = torch.randn(8, 64, generator=torch.Generator().manual_seed(seed))
+        guider.model_patcher.patches = {key: [(1.0, ("lora", (lora, lora.T, None, None)), 1.0, None, None)]}
+        hashes.append(ttp.model_patcher_hash(guider.model_patcher))
+    assert hashes[0] != hashes[1]
+
+
+def test_unhashable_model_does_not_abort_sampling(mock_env, monkeypatch):
+    def fail(model_patcher):
+        raise TypeError("tensor subclass")
+    monkeypatch.setattr(ttp, "model_patcher_hash", fail)
+    run_sampler(mock_env, MockGuider(mock_env), steps=10)
+
+
+def test_fit_reports_the_required_number_of_calls():
+    with pytest.raises(ValueError, match="at least 6 model calls, got 5"):
+        ttp.fit_teacache_profile([0.1, 0.2, 0.3, 0.4], [0.1, 0.2, 0.3, 0.4])
+    ttp.fit_teacache_profile([0.1, 0.2, 0.3, 0.4, 0.5], [0.1, 0.2, 0.3, 0.4, 0.5])
+
+
+def time_decisions(decide, inputs, repeats=5):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        decide(inputs)
+        if inputs[0].is_cuda:
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best / len(inputs) * 1e3
+
+
+def compare_cache_modes(steps=50, shape=(1, 4, 5, 32, 32)):
+    """Relative error against the uncached run and full forwards per preset, output vs residual caching."""
+    torch.manual_seed(0)
+    model = HunyuanVideo()
+    reference = run_sampler(model, MockGuider(model), "Original (1x)", steps=steps, shape=shape)
+    rows = []
+    for speedup in list(ttp.TEACACHE_PRESET_SPEEDS)[1:]:
+        for cache_mode in ("output", "residual"):
+            model.full_forwards = 0
+            result = run_sampler(model, MockGuider(model), speedup, cache_mode=cache_mode, steps=steps, shape=shape)
+            error = ((result - reference).abs().mean() / reference.abs().mean()).item()
+            rows.append((speedup, cache_mode, steps / model.full_forwards, error))
+    return rows
+
+
+def test_residual_caching_is_closer_to_uncached_run(mock_env):
+    rows = compare_cache_modes(steps=30, shape=(1, 4, 3, 16, 16))
+    for (speedup, _, output_speed, output_error), (_, _, residual_speed, residual_error) in zip(rows[::2], rows[1::2]):
+        assert residual_speed == output_speed, speedup
+        assert residual_error < output_error, speedup
+
+
+if __name__ == "__main__":
+    ttp.latent_preview.prepare_callback = lambda *args, **kwargs: None
+    for speedup, cache_mode, speed, error in compare_cache_modes():
+        print(f"{speedup:24s} {cache_mode:8s} {speed:.2f}x fewer full forwards, rel. error {error:.4f}")
+
+    # Per-step cost of the skip decision alone, synchronous .item() rule against the lagged one
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    for device in devices:
+        inputs = [t.to(device) for t in modulated_inputs(50, torch.bfloat16, shape=(1, 4096, 3072))]
+        sync = time_decisions(lambda seq: teacache_schedule(seq, COEFFICIENTS, 0.15), inputs)
+        lagged = time_decisions(lambda seq: teacache_schedule(seq, COEFFICIENTS, 0.15, lagged_decision=True), inputs)
+        print(f"{device}: synchronous {sync:.3f} ms/step, lagged {lagged:.3f} ms/step")
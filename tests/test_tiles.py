@@ -0,0 +1,218 @@
+"""Tiling and assembly tests. CPU only; run from a ComfyUI checkout so the comfy modules import."""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import pytest
+import torch
+
+pytest.importorskip("comfy.model_management")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TTP_toolsets as ttp  # noqa: E402
+
+
+def quantised_image(num_frames, height, width, seed=0):
+    """Random image on the 8-bit grid, so the PIL paths see exactly the same values."""
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randint(0, 256, (num_frames, height, width, 3), generator=generator).float() / 255
+
+
+def baseline_tile_image(image, tile_width, tile_height):
+    """TTP_Image_Tile_Batch as it was before the tensor gather: PIL crops of the first frame."""
+    image = ttp.tensor2pil(image.squeeze(0))
+    img_width, img_height = image.size
+    if img_width <= tile_width and img_height <= tile_height:
+        return ttp.pil2tensor(image), [(0, 0, img_width, img_height)], (img_width, img_height), (1, 1)
+
+    def calculate_step(size, tile_size):
+        if size <= tile_size:
+            return 1, 0
+        num_tiles = (size + tile_size - 1) // tile_size
+        overlap = (num_tiles * tile_size - size) // (num_tiles - 1)
+        return num_tiles, tile_size - overlap
+
+    num_cols, step_x = calculate_step(img_width, tile_width)
+    num_rows, step_y = calculate_step(img_height, tile_height)
+    tiles, positions = [], []
+    for y in range(num_rows):
+        for x in range(num_cols):
+            left, upper = x * step_x, y * step_y
+            right, lower = min(left + tile_width, img_width), min(upper + tile_height, img_height)
+            if right - left < tile_width:
+                left = max(0, img_width - tile_width)
+            if lower - upper < tile_height:
+                upper = max(0, img_height - tile_height)
+            tiles.append(ttp.pil2tensor(image.crop((left, upper, right, lower))))
+            positions.append((left, upper, right, lower))
+    return torch.stack(tiles, dim=0).squeeze(1), positions, (img_width, img_height), (num_cols, num_rows)
+
+
+def sampled_tiles(tiles, seed=1):
+    """Tiles with a different offset each, like independently sampled tiles, kept on the 8-bit grid."""
+    generator = torch.Generator().manual_seed(seed)
+    offsets = torch.randint(-40, 41, (tiles.shape[0], 1, 1, 1), generator=generator).float() / 255
+    return ((tiles + offsets).clamp(0, 1) * 255).round() / 255
+
+
+def tile_and_assemble(image, tile_size, padding, assembly_mode, blend_curve="linear", perturb=True):
+    tiles, positions, original_size, grid_size, _, _ = ttp.TTP_Image_Tile_Batch().tile_image(image, tile_size, tile_size)
+    if perturb:
+        tiles = sampled_tiles(tiles)
+    output, = ttp.TTP_Image_Assy().assemble_image(tiles, positions, original_size, grid_size, padding, assembly_mode, blend_curve)
+    return output
+
+
+@pytest.mark.parametrize("size, tile_width, tile_height", [((700, 1000), 384, 384), ((2100, 1500), 1024, 1024), ((513, 777), 256, 320), ((300, 200), 512, 512)])
+def test_tiles_match_baseline(size, tile_width, tile_height):
+    image = quantised_image(1, *size)
+    tiles, positions, original_size, grid_size, passes, _ = ttp.TTP_Image_Tile_Batch().tile_image(image, tile_width, tile_height)
+    expected_tiles, expected_positions, expected_size, expected_grid = baseline_tile_image(image, tile_width, tile_height)
+    assert positions == expected_positions
+    assert (original_size, grid_size) == (expected_size, expected_grid)
+    assert passes == tiles.shape[0] == len(positions)
+    assert torch.equal(tiles, expected_tiles)
+
+
+def test_tile_positions_follow_fixed_tile_starts():
+    height, width = 2100, 1500
+    _, positions, _, grid_size, _, _ = ttp.TTP_Image_Tile_Batch().tile_image(quantised_image(1, height, width), 1024, 768)
+    lefts, uppers = ttp.fixed_tile_starts(width, 1024), ttp.fixed_tile_starts(height, 768)
+    assert grid_size == (len(lefts), len(uppers))
+    assert [pos[:2] for pos in positions] == [(left, upper) for upper in uppers for left in lefts]
+
+
+@pytest.mark.parametrize("blend_curve", ["linear", "cosine", "smoothstep"])
+@pytest.mark.parametrize("size, tile_size, padding", [((700, 1000), 384, 64), ((513, 777), 256, 32), ((640, 640), 256, 0)])
+def test_tensor_assembly_matches_pil(size, tile_size, padding, blend_curve):
+    image = quantised_image(1, *size)
+    tensor = tile_and_assemble(image, tile_size, padding, "tensor", blend_curve)
+    pil = tile_and_assemble(image, tile_size, padding, "pil", blend_curve)
+    assert tensor.shape == pil.shape == image.shape
+    assert (tensor - pil).abs().max() <= 1 / 255 + 1e-6
+
+
+@pytest.mark.parametrize("blend_curve", ["linear", "cosine"])
+@pytest.mark.parametrize("size, tile_size, padding", [((700, 1000), 384, 64), ((513, 777), 256, 32), ((640, 640), 256, 0)])
+def test_streaming_assembly_matches_tensor_and_pil(size, tile_size, padding, blend_curve):
+    image = quantised_image(2, *size)
+    streaming = tile_and_assemble(image, tile_size, padding, "streaming", blend_curve)
+    tensor = tile_and_assemble(image, tile_size, padding, "tensor", blend_curve)
+    pil = tile_and_assemble(image, tile_size, padding, "pil", blend_curve)
+    assert streaming.shape == image.shape
+    assert (streaming - tensor).abs().max() <= 1e-5
+    assert (streaming - pil).abs().max() <= 1 / 255 + 1e-6
+
+
+@pytest.mark.parametrize("assembly_mode", ["tensor", "pil", "streaming"])
+def test_unchanged_tiles_reassemble_the_image(assembly_mode):
+    image = quantised_image(1, 700, 1000)
+    output = tile_and_assemble(image, 384, 64, assembly_mode, perturb=False)
+    assert (output - image).abs().max() <= 1e-5
+
+
+@pytest.mark.parametrize("assembly_mode", ["tensor", "pil"])
+def test_multi_frame_batches_tile_and_assemble_per_frame(assembly_mode):
+    frames = quantised_image(3, 513, 777)
+    tiler, assy = ttp.TTP_Image_Tile_Batch(), ttp.TTP_Image_Assy()
+    tiles, positions, original_size, grid_size, passes, _ = tiler.tile_image(frames, 256, 256)
+    single = [tiler.tile_image(frame[None], 256, 256) for frame in frames]
+    assert torch.equal(tiles, torch.cat([result[0] for result in single]))
+    assert positions == [(*pos, frame) for frame in range(3) for pos in single[0][1]]
+    assert passes == tiles.shape[0] == 3 * grid_size[0] * grid_size[1]
+
+    tiles = sampled_tiles(tiles)
+    output, = assy.assemble_image(tiles, positions, original_size, grid_size, 32, assembly_mode)
+    num_tiles = grid_size[0] * grid_size[1]
+    for frame in range(3):
+        expected, = assy.assemble_image(tiles[frame * num_tiles:(frame + 1) * num_tiles], single[frame][1], original_size, grid_size, 32, assembly_mode)
+        assert torch.allclose(output[frame:frame + 1], expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("num_frames", [1, 3])
+def test_disk_storage_tiles_match_memory_and_round_trip(num_frames):
+    frames = quantised_image(num_frames, 513, 777)
+    tiler = ttp.TTP_Image_Tile_Batch()
+    in_memory = tiler.tile_image(frames, 256, 256)
+    on_disk = tiler.tile_image(frames, 256, 256, storage="disk")
+    assert torch.equal(on_disk[0], in_memory[0])
+    assert on_disk[1:] == in_memory[1:]
+
+    tiles, positions, original_size, grid_size, _, _ = on_disk
+    output, = ttp.TTP_Image_Assy().assemble_image(tiles, positions, original_size, grid_size, 32, "streaming")
+    assert (output - frames).abs().max() <= 1e-5
+
+
+def test_tile_cache_store_skips_the_sampler_on_a_full_hit(tmp_path):
+    tiles = quantised_image(4, 64, 64)
+    keys = [f"tile{i}" for i in range(4)]
+    store = ttp.TTP_Tile_Cache_Store()
+    assert store.check_lazy_status([0, 1, 2, 3]) == ["sampled_tiles"]
+    first, _ = store.store(tiles, [0, 1, 2, 3], keys, str(tmp_path))
+
+    # A re-run where every tile hits never asks for the sampler output
+    assert store.check_lazy_status([]) == []
+    cached, _ = store.store(None, [], keys, str(tmp_path))
+    assert torch.equal(first, tiles)
+    # The cache keeps float16, well inside one 8-bit level
+    assert cached.shape == tiles.shape and (cached - tiles).abs().max() <= 1e-3
+
+
+@pytest.mark.parametrize("grid_mode", ["fixed", "planned"])
+@pytest.mark.parametrize("shape", [(2, 4, 90, 130), (1, 16, 5, 64, 100)])
+def test_latent_tiles_reassemble_the_latent(shape, grid_mode):
+    latent = torch.randn(shape, generator=torch.Generator().manual_seed(0))
+    samples = {"samples": latent, "noise_mask": torch.rand((shape[0], 1, *shape[-2:]))}
+    tiled, positions, original_size, grid_size, passes = ttp.TTP_Latent_Tile_Batch().tile_latent(samples, 512, 384, grid_mode=grid_mode)
+    num_tiles = grid_size[0] * grid_size[1]
+    assert passes == tiled["samples"].shape[0] == shape[0] * num_tiles == len(positions)
+    assert original_size == (shape[-1] * 8, shape[-2] * 8)
+    if grid_mode == "planned":
+        # Default align=2 keeps tiles on whole patches of patch-2 DiTs
+        assert tiled["samples"].shape[-1] % 2 == 0 and tiled["samples"].shape[-2] % 2 == 0
+
+    assembled, = ttp.TTP_Latent_Assy().assemble_latent(tiled, positions, original_size, grid_size, 64)
+    assert torch.allclose(assembled["samples"], latent, atol=1e-5)
+    assert torch.allclose(assembled["noise_mask"], samples["noise_mask"], atol=1e-5)
+
+
+@pytest.mark.parametrize("mode, factor, overlap_rate, min_overlap", [
+    ("factor", 3, 0.1, 64), ("factor", 4, 0.0, 64), ("factor", 2, 0.5, 64),
+    ("planned", 3, 0.1, 64), ("planned", 3, 0.1, 256), ("planned", 4, 0.1, 400),
+])
+def test_tile_image_size_predicts_the_tile_batch_passes(mode, factor, overlap_rate, min_overlap):
+    image = torch.zeros((2, 1000, 1000, 3))
+    tile_width, tile_height, passes = ttp.Tile_imageSize().image_width_height(image, factor, factor, overlap_rate, mode, min_overlap)
+    assert passes == ttp.TTP_Image_Tile_Batch().tile_image(image, tile_width, tile_height)[4]
+
+
+def measure_tiling(tiler, width, height, tile_size, queue):
+    """Wall time and peak RSS above the input image of one tiling call, in a fresh process."""
+    image = torch.rand((1, height, width, 3))
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if tiler == "baseline":
+        tiles = baseline_tile_image(image, tile_size, tile_size)[0]
+    else:
+        tiles = ttp.TTP_Image_Tile_Batch().tile_image(image, tile_size, tile_size)[0]
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    queue.put((elapsed, peak / 2**10, tiles.nbytes / 2**20))
+
+
+if __name__ == "__main__":
+    # Each run gets its own process, so ru_maxrss is the peak of that run alone
+    context = multiprocessing.get_context("spawn")
+    for name, (width, height) in {"4K": (3840, 2160), "8K": (7680, 4320), "16K": (15360, 8640)}.items():
+        for tiler in ("baseline", "gather"):
+            queue = context.Queue()
+            process = context.Process(target=measure_tiling, args=(tiler, width, height, 1024, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print(f"{name} {tiler:8s}: failed with exit code {process.exitcode} (out of memory?)")
+                continue
+            elapsed, peak, output = queue.get()
+            print(f"{name} {tiler:8s}: {elapsed:.2f} s, peak {peak:.0f} MB above the input, {output:.0f} MB of tiles")